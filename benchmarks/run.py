@@ -0,0 +1,204 @@
+#!/bin/env python
+"""
+Benchmarks for sn_stat: time and peak memory of the main calculation stages.
+
+Usage:
+    python benchmarks/run.py [-k FILTER] [-o results.json]
+        run the benchmarks for the current source tree
+    python benchmarks/run.py --rev REV [-k FILTER] [-o results.json]
+        run the benchmarks for the given git revision (checked out in a temporary worktree)
+    python benchmarks/run.py --compare old.json new.json
+        print the comparison of two results files
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import itertools
+import numpy as np
+
+benchmarks = {}
+
+def benchmark(**params):
+    """ register the benchmark function for each combination of the parameters values """
+    def _decorator(func):
+        keys = list(params)
+        for vals in itertools.product(*params.values()):
+            kwargs = dict(zip(keys,vals))
+            name = func.__name__+('['+','.join(f'{k}={v}' for k,v in kwargs.items())+']' if kwargs else '')
+            benchmarks[name] = (func, kwargs)
+        return func
+    return _decorator
+
+def _detector(k=1):
+    import sn_stat as sn
+    from sn_stat.signals import ccSN
+    return sn.DetConfig(B=sn.rate(10*k), S=ccSN(S0=100*k).at(10), time_window=[0,15])
+
+#each benchmark function prepares the data and returns the function to measure
+@benchmark()
+def import_time():
+    cmd = [sys.executable, '-c', 'import sn_stat']
+    return lambda: subprocess.check_call(cmd, env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+@benchmark(Nevents=[1000,10000,100000], Nt0=[1000,10000], method=['dense','window'])
+def llr(Nevents, Nt0, method):
+    import sn_stat as sn
+    if method=='dense' and Nevents*Nt0>10**8:
+        return None
+    l = sn.LLR(_detector())
+    ts = np.random.default_rng(0).uniform(0, Nevents/10, Nevents)
+    t0 = np.linspace(0, Nevents/10, Nt0)
+    return lambda: l(ts, t0, method=method)
+
+@benchmark(Nsamples=[1000,10000], dl=[1e-2,1e-3], epsilon=[1e-8,1e-16])
+def joint_distr(Nsamples, dl, epsilon):
+    import sn_stat as sn
+    llrs = [sn.LLR(_detector())]
+    return lambda: sn.JointDistr(llrs, Nsamples=Nsamples, dl=dl, epsilon=epsilon)
+
+@benchmark(sampling=['uniform','adaptive'])
+def joint_distr_sampling(sampling):
+    import sn_stat as sn
+    from sn_stat.signals import ccSN
+    det = sn.DetConfig(B=sn.rate(1), S=ccSN(S0=100).at(10), time_window=[0,15])
+    #new LLR object every time: the samples are memoised
+    return lambda: sn.JointDistr([sn.LLR(det)], sampling=sampling)
+
+@benchmark(combine=['fft','lazy'])
+def joint_distr_combine(combine):
+    import sn_stat as sn
+    from sn_stat.signals import ccSN
+    dets = [sn.DetConfig(B=sn.rate(b), S=ccSN(S0=s).at(10), time_window=[0,15]) for b,s in [(10,100),(0.5,5)]]
+    llrs = [sn.LLR(d) for d in dets]
+    return lambda: sn.JointDistr(llrs, combine=combine)
+
+@benchmark(Nhypos=[10,50])
+def sensitivity(Nhypos):
+    import sn_stat as sn
+    from sn_stat.signals import ccSN
+    dets = [_detector(k+1) for k in range(2)]
+    ana = sn.ShapeAnalysis(dets)
+    ana.d0
+    sigs = [ccSN(S0=100*(k+1)) for k in range(2)]
+    hypos_list = [[s.at(d) for s in sigs] for d in np.linspace(5,50,Nhypos)]
+    if hasattr(ana, 'z_quant_batch'):
+        return lambda: ana.z_quant_batch(hypos_list, add_bg=True)
+    return lambda: [ana.z_quant(h, add_bg=True) for h in hypos_list]
+
+@benchmark(Ndet=[1,2,4,8])
+def shape_analysis_init(Ndet):
+    import sn_stat as sn
+    dets = [_detector(k+1) for k in range(Ndet)]
+    return lambda: sn.ShapeAnalysis(dets).d0
+
+@benchmark(Ndet=[1,2,4,8])
+def shape_analysis_scan(Ndet):
+    import sn_stat as sn
+    dets = [_detector(k+1) for k in range(Ndet)]
+    ana = sn.ShapeAnalysis(dets)
+    rng = np.random.default_rng(0)
+    ts = [rng.uniform(0, 1000, 10000*(k+1)) for k in range(Ndet)]
+    t0 = np.linspace(0, 1000, 10000)
+    return lambda: ana(ts, t0)
+
+@benchmark(Nevents=[10000,100000])
+def counting_analysis(Nevents):
+    import sn_stat as sn
+    ana = sn.CountingAnalysis(_detector())
+    ts = np.random.default_rng(0).uniform(0, Nevents/10, Nevents)
+    t0 = np.linspace(0, Nevents/10, 10000)
+    return lambda: ana(ts, t0)
+
+@benchmark(N=[1,100,10000])
+def sampler(N):
+    import sn_stat as sn
+    s = sn.Sampler(_detector().B+_detector().S, time_window=[0,100])
+    if hasattr(s, 'sample_many'):
+        return lambda: s.sample_many(N)
+    return lambda: [s.sample() for i in range(N)]
+
+def measure(func, kwargs, repeat=3, min_time=0.2):
+    """ measure the best time and the peak memory (with tracemalloc) of the benchmark """
+    f = func(**kwargs)
+    if f is None:
+        return None
+    times = []
+    for r in range(repeat):
+        n,t0 = 0,time.perf_counter()
+        while True:
+            f()
+            n+=1
+            t = time.perf_counter()-t0
+            if t>=min_time:
+                break
+        times+=[t/n]
+    tracemalloc.start()
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time':min(times), 'peak_memory':peak}
+
+def run(pattern=None):
+    results = {}
+    for name,(func,kwargs) in benchmarks.items():
+        if pattern and pattern not in name:
+            continue
+        try:
+            res = measure(func, kwargs)
+        except Exception as e:
+            res = {'error':repr(e)}
+        if res is None:
+            continue
+        results[name] = res
+        print(f'{name:60s} '+(f"{res['time']*1e3:10.3f} ms {res['peak_memory']/2**20:10.2f} MB"
+                                if 'time' in res else res['error']), file=sys.stderr)
+    return results
+
+def run_rev(rev, pattern=None):
+    """ run this benchmark script on the source tree of the given git revision """
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = subprocess.check_output(['git','-C',here,'rev-parse','--show-toplevel'], text=True).strip()
+    with tempfile.TemporaryDirectory() as tmp:
+        wt = os.path.join(tmp,'src')
+        subprocess.check_call(['git','-C',root,'worktree','add','--detach',wt,rev])
+        try:
+            env = dict(os.environ, PYTHONPATH=wt)
+            out = os.path.join(tmp,'results.json')
+            cmd = [sys.executable, os.path.abspath(__file__), '-o', out]+(['-k',pattern] if pattern else [])
+            subprocess.check_call(cmd, env=env, cwd=tmp)
+            with open(out) as f:
+                return json.load(f)
+        finally:
+            subprocess.check_call(['git','-C',root,'worktree','remove','--force',wt])
+
+def compare(old, new):
+    """ print the comparison table of two results """
+    print(f"{'benchmark':60s} {'old, ms':>10s} {'new, ms':>10s} {'ratio':>7s} {'old, MB':>9s} {'new, MB':>9s}")
+    for name in sorted(set(old)|set(new)):
+        o,n = old.get(name,{}), new.get(name,{})
+        to,tn = o.get('time',np.nan)*1e3, n.get('time',np.nan)*1e3
+        mo,mn = o.get('peak_memory',np.nan)/2**20, n.get('peak_memory',np.nan)/2**20
+        print(f'{name:60s} {to:10.3f} {tn:10.3f} {tn/to:7.2f} {mo:9.2f} {mn:9.2f}')
+
+if __name__=='__main__':
+    if 'PYTHONPATH' not in os.environ:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='pattern', default=None, help='run only benchmarks containing this string')
+    parser.add_argument('-o', '--output', default=None, help='output JSON file')
+    parser.add_argument('--rev', default=None, help='git revision to benchmark')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD','NEW'), help='compare two results files')
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as f0, open(args.compare[1]) as f1:
+            compare(json.load(f0), json.load(f1))
+        sys.exit(0)
+    results = run_rev(args.rev, args.pattern) if args.rev else run(args.pattern)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results, f, indent=1)
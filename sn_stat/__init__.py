@@ -1,7 +1,8 @@
 from .det_config import DetConfig
 from .rate import rate,log_rate
 from .sampler import Sampler
-from .llr import LLR, JointDistr
+from .llr import LLR, JointDistr, JointDistrBatch
 from .signals import Signal
-from .sig_calc import  ShapeAnalysis,CountingAnalysis, z2p, p2z
+from .sig_calc import  ShapeAnalysis,CountingAnalysis,TimeVaryingShapeAnalysis, z2p, p2z
+from .stream import ShapeStream
 __version__="0.3.3"
@@ -0,0 +1,24 @@
+import importlib
+
+class LazyModule:
+    """
+    Module, which is imported on the first access to its attributes.
+    Used for the heavy SciPy submodules, to keep `import sn_stat` fast.
+
+    Args:
+        name (str): full name of the module
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name}>'
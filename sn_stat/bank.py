@@ -0,0 +1,99 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .det_config import DetConfig
+from .llr import window_bounds, window_chunks
+from .sig_calc import ShapeAnalysis
+
+class TemplateBank:
+    """
+    Shape analysis for the bank of signal templates, applied to the same dataset.
+
+    Each template is the set of detector configurations (one for each detector),
+    with its own signal rate and time window.
+    The events of each detector are sorted once, and the (event, `t0`) pairs inside
+    the widest time window of all the templates are found once (see :meth:`LLR.llr_window`),
+    and the LLR of each template is evaluated on the pairs inside its time window.
+    The background rate is evaluated once for every distinct background object.
+
+    The :class:`ShapeAnalysis` (with the null hypothesis distribution) of each template
+    is constructed in the thread pool, optionally using the persistent cache.
+
+    Args:
+        templates (list of :class:`DetConfig` or list of list of :class:`DetConfig`):
+            detector configurations for each template. All templates must have the same number of detectors.
+            If there is only one detector, a single :class:`DetConfig` for each template is enough
+        cache (None or str or :class:`sn_stat.cache.DistrCache`):
+            the cache for the LLR distributions (see :class:`ShapeAnalysis`)
+        workers (int or None): number of threads for constructing the analyses
+
+    Keyword Args:
+        params (dict of kwargs):
+            configuration arguments to be passed to :func:`sn_stat.llr.JointDistr`
+    """
+    def __init__(self, templates, cache=None, workers=None, **params):
+        templates = [[t] if isinstance(t, DetConfig) else list(t) for t in templates]
+        if len({len(t) for t in templates})>1:
+            raise ValueError('All templates should have the same number of detectors')
+        self.templates = templates
+        def _make(dets):
+            ana = ShapeAnalysis(dets, cache=cache, **params)
+            ana.d0 #calculate the null distribution in the pool
+            return ana
+        with ThreadPoolExecutor(workers) as pool:
+            self.analyses = list(pool.map(_make, templates))
+
+    def __len__(self):
+        return len(self.templates)
+
+    def l_val(self, data, t0, chunk_size=2**20):
+        """
+        Calculate the sum of LLR values of all the detectors for each template
+
+        Args:
+            data (iterable of array of float):
+                List with arrays of measured events time stamps for each detector.
+                If there is only one detector, just an array(float) is enough
+            t0 (ndarray of float):
+                assumed time/times of signal start
+            chunk_size (int): maximal number of (event, t0) pairs processed at once
+        Returns:
+            ndarray of float:
+                test statistic values with shape `(len(templates), len(t0))`
+        """
+        ndet = len(self.templates[0])
+        if(len(data)!=ndet):
+            data = np.array(data, ndmin=2)
+            assert data.shape[0]==ndet
+        t0 = np.array(t0, ndmin=1, dtype=float)
+        res = np.zeros((len(self.templates),len(t0)))
+        for i in range(ndet):
+            dets = [tpl[i] for tpl in self.templates]
+            ts = np.sort(np.array(data[i], ndmin=1, dtype=float), kind='stable')
+            if ts.size==0 or t0.size==0:
+                continue
+            tw = np.array([d.time_window for d in dets])
+            lo,hi = window_bounds(ts, t0, (tw[:,0].min(), tw[:,1].max()))
+            e0, e1 = lo.min(), hi.max()
+            bs = {}
+            for d in dets:
+                if id(d.B) not in bs:
+                    bs[id(d.B)] = np.zeros(ts.shape)
+                    bs[id(d.B)][e0:e1] = d.B(ts[e0:e1])
+            for i0,i1,j_ev,j_t0 in window_chunks(lo,hi,chunk_size):
+                tSN = ts[j_ev]-t0[j_t0]
+                for k,d in enumerate(dets):
+                    #the rates are evaluated only inside the time window of the template
+                    sel = np.flatnonzero((tSN>=d.time_window[0])&(tSN<=d.time_window[1]))
+                    l = np.log(1+d.S(tSN[sel])/bs[id(d.B)][j_ev[sel]])
+                    res[k,i0:i1] += np.bincount(j_t0[sel]-i0, weights=l, minlength=i1-i0)
+        return res
+
+    def __call__(self, data, t0, **params):
+        """
+        Calculate significance for each template
+
+        Returns:
+            ndarray of float: significance values with shape `(len(templates), len(t0))`
+        """
+        ls = self.l_val(data, t0, **params)
+        return np.stack([a.l2z(l) for a,l in zip(self.analyses, ls)]).reshape(ls.shape)
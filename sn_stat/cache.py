@@ -0,0 +1,191 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from ._lazy import LazyModule
+stats = LazyModule('scipy.stats')
+from .llr import JointDistr, JointDistrBatch, Distr, NormConvDistr
+from .rate import Const, Interpolated, LogRate, Tabulated, _limited, _mul, _sum, _shift, _invert
+
+#version of the stored data format: increase to invalidate the old cache files
+_FORMAT = 4
+
+def rate_fingerprint(r, t0, t1, Npoints=10000):
+    """
+    Calculate the fingerprint of the rate on the interval (t0,t1).
+
+    The rate expression tree is walked, and the exact parameters of the rates
+    (constants, interpolation tables, ranges, factors and shifts) are used.
+    Only the rates, defined by the functions (:class:`sn_stat.rate.Func`), are sampled
+    on `Npoints` equidistant points in the interval (with the integral over the interval),
+    so their features, narrower than the sampling step, can be missed.
+
+    Returns:
+        bytes: fingerprint, which can be used in hash
+    """
+    def _arr(*a):
+        return np.concatenate([np.ravel(np.asarray(x, dtype=np.float64)) for x in a]).tobytes()
+    name = type(r).__name__.encode()
+    if isinstance(r, Const):
+        return name+_arr(r.c)
+    if isinstance(r, Interpolated):
+        knots, coeffs = r.f.get_knots(), r.f.get_coeffs()
+        #the spline degree and the extrapolation mode
+        k = len(coeffs)-len(knots)+1
+        return name+_arr(r.range, k, r.f.ext, knots, coeffs)
+    if isinstance(r, (LogRate, Tabulated)):
+        return name+_arr(r.x, r.y, getattr(r,'extrapolate',0))
+    if isinstance(r, _limited):
+        return name+_arr(r.range)+b'('+rate_fingerprint(r._r0, t0, t1, Npoints)+b')'
+    if isinstance(r, _mul):
+        return name+_arr(r.C)+b'('+rate_fingerprint(r._r0, t0, t1, Npoints)+b')'
+    if isinstance(r, _sum):
+        return name+b'('+rate_fingerprint(r.r0, t0, t1, Npoints)+b','+rate_fingerprint(r.r1, t0, t1, Npoints)+b')'
+    if isinstance(r, _shift):
+        return name+_arr(r.dt)+b'('+rate_fingerprint(r.r0, t0-r.dt, t1-r.dt, Npoints)+b')'
+    if isinstance(r, _invert):
+        return name+b'('+rate_fingerprint(r.r0, -t1, -t0, Npoints)+b')'
+    ts = np.linspace(t0,t1,Npoints)
+    vals = np.broadcast_to(r(ts),ts.shape)
+    return name+_arr(t0, t1, vals, r.integral(t0,t1))
+
+class DistrCache:
+    """
+    Persistent content-addressed cache of the LLR distributions, calculated by :func:`sn_stat.llr.JointDistr`.
+
+    Each distribution is stored as a `.npz` file in the cache directory.
+    The file name is the hash of the detectors configurations (time windows and rates fingerprints,
+    see :func:`rate_fingerprint`), the hypotheses and the parameters of :func:`sn_stat.llr.JointDistr`.
+    When the total size of the files exceeds `max_size`, the least recently used files are removed.
+
+    Args:
+        path (str or None):
+            cache directory. If None - use `$SN_STAT_CACHE` or `~/.cache/sn_stat`
+        max_size (int):
+            maximal total size of the cache files in bytes
+    """
+    def __init__(self, path=None, max_size=100*2**20):
+        if path is None:
+            path = os.environ.get('SN_STAT_CACHE', os.path.join('~','.cache','sn_stat'))
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, llrs, hypos='H0', **params):
+        """
+        Calculate the hash of the :func:`sn_stat.llr.JointDistr` arguments
+
+        Returns:
+            str: hexadecimal hash string
+        """
+        t0 = params.get('t0',0)
+        h = hashlib.sha256(f'{_FORMAT}:{sorted(params.items())}'.encode())
+        if hypos=='H0':
+            hypos = [l.det.B for l in llrs]
+        for l,hypo in zip(llrs,hypos):
+            tw = l.det.time_window+t0
+            h.update(np.asarray(tw,dtype=np.float64).tobytes())
+            h.update(rate_fingerprint(l.det.S, *l.det.time_window))
+            h.update(rate_fingerprint(l.det.B, *tw))
+            h.update(rate_fingerprint(hypo, *tw))
+        return h.hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.path, key+'.npz')
+
+    def get(self, key):
+        """
+        Load the distribution from cache
+
+        Returns:
+            :class:`sn_stat.llr.Distr`, :class:`sn_stat.llr.NormConvDistr` or :class:`scipy.stats.norm`,
+            or None, if the key is not in the cache
+        """
+        fname = self._fname(key)
+        try:
+            with np.load(fname) as f:
+                if f['kind']=='norm':
+                    d = stats.norm(loc=float(f['loc']), scale=float(f['scale']))
+                elif f['kind']=='normconv':
+                    d = NormConvDistr(Distr(bins=f['bins'], vals=f['vals']), loc=float(f['loc']), scale=float(f['scale']))
+                else:
+                    d = Distr(bins=f['bins'], vals=f['vals'])
+                    d.set_interpolation()
+            os.utime(fname)
+        except (OSError, KeyError, ValueError):
+            return None
+        return d
+
+    def put(self, key, d):
+        """ Store the distribution in cache and remove the least recently used files, if needed"""
+        fname = self._fname(key)
+        tmpname = f'{fname}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmpname,'wb') as f:
+                if isinstance(d, Distr):
+                    np.savez(f, kind='distr', bins=d.bins, vals=d.vals)
+                elif isinstance(d, NormConvDistr):
+                    np.savez(f, kind='normconv', bins=d.distr.bins, vals=d.distr.vals, loc=d.loc, scale=d.scale)
+                else:
+                    np.savez(f, kind='norm', loc=d.mean(), scale=d.std())
+            os.replace(tmpname, fname)
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used files, until the cache size is below `max_size` """
+        #the files can be removed or replaced by other processes, sharing the cache directory
+        files = []
+        for e in os.scandir(self.path):
+            if e.name.endswith('.npz'):
+                try:
+                    files+=[(e.stat().st_mtime, e.stat().st_size, e.path)]
+                except FileNotFoundError:
+                    pass
+        size = 0
+        for mtime,fsize,path in sorted(files, reverse=True):
+            size+=fsize
+            if size>self.max_size:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        """ Remove all the cache files """
+        for e in os.scandir(self.path):
+            if e.name.endswith('.npz'):
+                try:
+                    os.remove(e.path)
+                except FileNotFoundError:
+                    pass
+
+    def joint_distr(self, llrs, hypos='H0', **params):
+        """
+        Cached version of :func:`sn_stat.llr.JointDistr`: load the distribution from cache,
+        or calculate and store it
+        """
+        key = self.key(llrs, hypos, **params)
+        d = self.get(key)
+        if d is None:
+            d = JointDistr(llrs, hypos, **params)
+            self.put(key, d)
+        return d
+
+    def joint_distr_batch(self, llrs, hypos_list, workers=None, **params):
+        """
+        Cached version of :func:`sn_stat.llr.JointDistrBatch`: load the distributions from cache,
+        and calculate and store only the missing ones
+        """
+        hypos_list = list(hypos_list)
+        keys = [self.key(llrs, h, **params) for h in hypos_list]
+        ds = [self.get(k) for k in keys]
+        missing = [i for i,d in enumerate(ds) if d is None]
+        if missing:
+            new = JointDistrBatch(llrs, [hypos_list[i] for i in missing], workers=workers, **params)
+            for i,d in zip(missing, new):
+                self.put(keys[i], d)
+                ds[i] = d
+        return ds
@@ -0,0 +1,196 @@
+"""
+Compiled (numba) kernels for the LLR calculation.
+
+The rate expression tree is flattened into the list of terms:
+
+    .. math:: S(t) = \\sum_i C_i\\, f_i(s_i t+o_i)
+
+where :math:`s_i=\\pm1`, and :math:`f_i` is a constant, a linear interpolation table
+(:class:`sn_stat.rate.Interpolated` with `k=1` and `ext=1`, :class:`sn_stat.rate.Tabulated`, zero outside of the table)
+or a power law table (:class:`sn_stat.rate.LogRate` with `extrapolate=True`).
+The limited ranges of the constants and tables are included in the tables.
+The rates with other components (i.e. :class:`sn_stat.rate.Func`) are not supported:
+they can be tabulated with :meth:`sn_stat.rate.ABCRate.compile`.
+
+numba is optional: it is imported and the kernels are compiled on the first use
+(and cached on disk by numba). The kernels are single threaded:
+use the process pool (see :mod:`sn_stat.parallel`) for the parallel calculation.
+"""
+import importlib.util
+import numpy as np
+from .rate import Const, Interpolated, LogRate, Tabulated, _limited, _mul, _sum, _shift, _invert
+
+#term kinds
+_CONST, _LINEAR, _POWER = 0, 1, 2
+
+def have_numba():
+    """ check if numba is installed (without importing it)"""
+    return importlib.util.find_spec('numba') is not None
+
+def _clip(x, y, lo, hi):
+    """ limit the linear interpolation table to the range (lo,hi) """
+    a, b = max(lo, x[0]), min(hi, x[-1])
+    if a>b:
+        return None
+    if a==x[0] and b==x[-1]:
+        return x, y
+    inner = (x>a)&(x<b)
+    return np.concatenate([[a],x[inner],[b]]), np.concatenate([np.interp([a],x,y),y[inner],np.interp([b],x,y)])
+
+def _terms(r, C=1., s=1., o=0., lo=-np.inf, hi=np.inf):
+    """
+    flatten the rate tree into the list of terms (C, s, o, kind, x, y, a), or None if not supported.
+    The argument of the current node is `s*t+o`, and the rate is zero outside of the range (lo, hi) of it.
+    """
+    if isinstance(r, _mul):
+        return _terms(r._r0, C*r.C, s, o, lo, hi)
+    if isinstance(r, _sum):
+        t0,t1 = _terms(r.r0, C, s, o, lo, hi), _terms(r.r1, C, s, o, lo, hi)
+        return None if t0 is None or t1 is None else t0+t1
+    if isinstance(r, _shift):
+        return _terms(r.r0, C, s, o-r.dt, lo-r.dt, hi-r.dt)
+    if isinstance(r, _invert):
+        return _terms(r.r0, C, -s, -o, -hi, -lo)
+    if isinstance(r, _limited):
+        return _terms(r._r0, C, s, o, max(lo, r.range[0]), min(hi, r.range[1]))
+    if isinstance(r, Const):
+        if np.isinf(lo) and np.isinf(hi):
+            return [(C*r.c, s, o, _CONST, np.empty(0), np.empty(0), np.empty(0))]
+        x, y = np.array([lo,hi],dtype=float), np.array([r.c,r.c],dtype=float)
+    elif isinstance(r, Tabulated):
+        x, y = r.x, r.y
+    elif isinstance(r, Interpolated):
+        x, y = r.f.get_knots(), r.f.get_coeffs()
+        #only the linear spline (number of coefficients is `len(knots)+k-1`), which is zero outside of the knots
+        if len(y)!=len(x) or r.f.ext!=1:
+            return None
+        #linear spline coefficients are the values in the knots
+    elif isinstance(r, LogRate) and r.extrapolate and np.isinf(lo) and np.isinf(hi):
+        return [(C, s, o, _POWER, r.x, r.y, np.append(r.a, 0))]
+    else:
+        return None
+    table = _clip(np.asarray(x,dtype=float), np.asarray(y,dtype=float), lo, hi)
+    if table is None:
+        return []
+    return [(C, s, o, _LINEAR, *table, np.zeros(len(table[0])))]
+
+def _buckets(x):
+    """ index of the table interval for the uniform buckets: the fast search in the (nearly) uniform tables"""
+    n = len(x)
+    if n<2 or not x[-1]>x[0]:
+        return np.zeros(n, dtype=np.int64), 1.
+    h = (x[-1]-x[0])/(n-1)
+    idx = np.searchsorted(x, x[0]+np.arange(n)*h, side='right')-1
+    return np.clip(idx, 0, max(n-2,0)), 1/h
+
+def compile_rate(r):
+    """
+    Convert the rate to the arrays for the compiled kernels
+
+    Returns:
+        tuple of ndarray or None: the rate program, or None if the rate is not supported
+    """
+    terms = _terms(r)
+    if terms is None:
+        return None
+    buckets = [_buckets(t[4]) for t in terms]
+    #term parameters: C, s, o, inverse bucket width; and the table range and kind
+    T = np.array([t[:3]+(b[1],) for t,b in zip(terms,buckets)], dtype=np.float64).reshape(-1,4)
+    n = np.cumsum([0]+[len(t[4]) for t in terms])
+    tab = np.stack([n[:-1],n[1:],[t[3] for t in terms]],axis=1).astype(np.int64).reshape(-1,3)
+    cat = lambda i: np.concatenate([np.empty(0)]+[np.asarray(t[i],dtype=np.float64) for t in terms])
+    bk = np.concatenate([np.empty(0,dtype=np.int64)]+[b[0]+n0 for b,n0 in zip(buckets,n)]).astype(np.int64)
+    return T, tab, cat(4), cat(5), cat(6), bk
+
+_kernels = {}
+
+def _get_kernels():
+    if _kernels:
+        return _kernels
+    import numba
+
+    @numba.njit(cache=True, inline='always')
+    def search(xs, i0, i1, u):
+        #index k in [i0,i1-2]: xs[k]<=u<xs[k+1]
+        base, n = i0, i1-1-i0
+        while n>1:
+            half = n>>1
+            if xs[base+half]<=u:
+                base += half
+            n -= half
+        return base
+
+    @numba.njit(cache=True, inline='always')
+    def rate_value(t, T, tab, xs, ys, aa, bk):
+        res = 0.
+        for i in range(T.shape[0]):
+            u = T[i,1]*t+T[i,2]
+            i0, i1, kind = tab[i,0], tab[i,1], tab[i,2]
+            v = 0.
+            if kind==0:
+                v = 1.
+            elif kind==1:
+                #linear interpolation, zero outside of the table (as numpy.interp(left=0,right=0))
+                if u>=xs[i0] and u<xs[i1-1]:
+                    if i1-i0<=16:
+                        k = search(xs, i0, i1, u)
+                    else:
+                        #start from the bucket of the uniform grid and walk to the interval
+                        k = bk[i0+min(int((u-xs[i0])*T[i,3]), i1-i0-2)]
+                        while k>i0 and xs[k]>u:
+                            k -= 1
+                        while xs[k+1]<=u:
+                            k += 1
+                    v = (ys[k+1]-ys[k])/(xs[k+1]-xs[k])*(u-xs[k])+ys[k]
+                elif u==xs[i1-1]:
+                    v = ys[i1-1]
+            else:
+                #power law segments, extrapolated outside of the table: the segment k with xs[k]<u<=xs[k+1]
+                k = i0
+                if u>xs[i0]:
+                    k = search(xs, i0, i1, u)
+                    if xs[k]==u and k>i0:
+                        k -= 1
+                v = ys[k]*(u/xs[k])**aa[k]
+            res += T[i,0]*v
+        return res
+
+    @numba.njit(cache=True)
+    def llr_window(ts, b, w, t0, lo, hi, tw0, tw1, T, tab, xs, ys, aa, bk):
+        res = np.zeros(len(t0))
+        for i in range(len(t0)):
+            acc = 0.
+            for j in range(lo[i], hi[i]):
+                tSN = ts[j]-t0[i]
+                if tSN<tw0 or tSN>tw1:
+                    continue
+                acc += np.log(1+rate_value(tSN, T, tab, xs, ys, aa, bk)/b[j])*w[j]
+            res[i] = acc
+        return res
+
+    _kernels.update(rate_value=rate_value, llr_window=llr_window)
+    return _kernels
+
+def rate_values(prog, t):
+    """ evaluate the compiled rate program (see :func:`compile_rate`) at the points `t` (for testing) """
+    f = _get_kernels()['rate_value']
+    return np.array([f(x, *prog) for x in np.ravel(t)]).reshape(np.shape(t))
+
+def llr_window(prog, ts, b, w, t0, lo, hi, time_window):
+    """
+    Fused compiled loop over the sorted events in the window of each `t0`:
+    evaluates the signal rate, LLR and the sum without temporary arrays (see :meth:`sn_stat.LLR.llr_window`)
+
+    Args:
+        prog (tuple): the signal rate program (see :func:`compile_rate`)
+        ts (ndarray): sorted events timestamps
+        b (ndarray): background rate values for the events
+        w (ndarray): events weights
+        t0 (ndarray): assumed supernova start times
+        lo, hi (ndarray of int): ranges of the events for each `t0` (see :func:`sn_stat.llr.window_bounds`)
+        time_window (tuple(float,float)): the time window
+    Returns:
+        ndarray: cumulative LLR values for each value of `t0`
+    """
+    return _get_kernels()['llr_window'](ts, b, w, t0, lo.astype(np.int64), hi.astype(np.int64),
+                                        float(time_window[0]), float(time_window[1]), *prog)
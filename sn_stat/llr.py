@@ -1,36 +1,111 @@
 import numpy as np
-from scipy import stats, fft, interpolate
+from concurrent.futures import ThreadPoolExecutor
+from ._lazy import LazyModule
+stats = LazyModule('scipy.stats')
+fft = LazyModule('scipy.fft')
+special = LazyModule('scipy.special')
+signal = LazyModule('scipy.signal')
 from .det_config import DetConfig
+from .rate import _constant, _mul, _sum
+from . import kernels
+from .profiling import stage
+
+def _step_next(x, y, v):
+    """ step function: value `y[i]` for the first `x[i]>=v` (`y[-1]` if there is none)"""
+    idx = np.searchsorted(x, v, side='left')
+    return y[np.minimum(idx, len(y)-1)]
 
 class Distr:
-    def __init__(self,bins,vals):
-        self.bins=bins
-        self.vals=vals
-    def set_interpolation(self):
-        def make_func(x,y):
-            X,Y = x,y
-            return interpolate.interp1d(X,Y, 
-                    fill_value=(Y[0],Y[-1]), 
-                    bounds_error=False, assume_sorted=True, kind='next')
+    """
+    Discrete distribution, defined by the histogram
 
+    The `pdf`, `sf` and `isf` are the step functions, evaluated by :func:`numpy.searchsorted`
+    lookup in the arrays of bin edges, bin centers and tail sums.
+
+    Args:
+        bins (1D array-like): bin edges (sorted), `len(vals)+1` values
+        vals (1D array-like): probabilities of each bin
+    """
+    __slots__ = ('bins','vals','tail','_binc','_pdf')
+    def __init__(self,bins,vals):
+        self.bins = np.asarray(bins, dtype=np.float64)
+        self.vals = np.asarray(vals, dtype=np.float64)
         tail = np.cumsum(self.vals[::-1])[::-1]
-        tail = np.concatenate((tail,[0]))
-        vals = np.concatenate(([0],self.vals,[0]))
-        binc = np.concatenate(([self.bins[0]],
+        self.tail = np.concatenate((tail,[0]))
+        self._pdf = np.concatenate(([0],self.vals,[0]))
+        self._binc = np.concatenate(([self.bins[0]],
                                      0.5*(self.bins[1:]+self.bins[:-1]),
                                      [self.bins[-1]]))
-        #set functions
-        self.pdf  = make_func(x=binc,y=vals)
-        self.sf   = make_func(x=self.bins,y=tail)
-        self.isf  = make_func(y=self.bins[::-1],x=tail[::-1])
+    def set_interpolation(self):
+        """ kept for compatibility: the lookup tables are prepared in the constructor"""
+        return self
+    def pdf(self, l):
+        "probability of the bin, which center is next to `l`"
+        return _step_next(self._binc, self._pdf, l)
+    def sf(self, l):
+        "survival function: probability of the values above `l`"
+        return _step_next(self.bins, self.tail, l)
+    def isf(self, p):
+        "inverse survival function"
+        return _step_next(self.tail[::-1], self.bins[::-1], p)
     def histogram(self, bins):
         if np.isscalar(bins):
             bins = np.linspace(self.bins[0],self.bins[-1],bins)
         N = -np.diff(self.sf(bins))
         return N, bins
+    def to_buffer(self):
+        """ serialize the distribution to the flat float64 buffer
+
+        Returns:
+            bytes: number of bins, bin edges and values
+        """
+        return np.concatenate(([len(self.vals)],self.bins,self.vals)).tobytes()
+    @classmethod
+    def from_buffer(cls, buf):
+        """ construct the distribution from the buffer, produced by :meth:`to_buffer`"""
+        a = np.frombuffer(buf, dtype=np.float64)
+        n = int(a[0])
+        return cls(bins=a[1:n+2], vals=a[n+2:2*n+2])
     def __repr__(self):
         return f'{__class__}(bins={self.bins}, vals={self.vals})'
 
+def window_bounds(ts, t0, time_window):
+    """
+    Find the events of the sorted array `ts` which can fall into the `time_window` around each `t0`.
+
+    The window edges are extended by the rounding error of `ts-t0`,
+    so the exact window condition should still be applied to the selected events.
+
+    Returns:
+        tuple(ndarray,ndarray): indices `lo`, `hi` of the events ranges `ts[lo:hi]` for each `t0`
+    """
+    t0 = np.asarray(t0, dtype=float)
+    tol = [4*np.finfo(float).eps*(np.abs(t0)+abs(t)) for t in time_window]
+    lo = np.searchsorted(ts, t0+time_window[0]-tol[0], side='left')
+    hi = np.searchsorted(ts, t0+time_window[1]+tol[1], side='right')
+    return lo, hi
+
+def window_chunks(lo, hi, chunk_size):
+    """
+    Split the event ranges `[lo:hi]` for each `t0` into chunks with bounded number of (event, t0) pairs.
+
+    Yields:
+        i0,i1 (int): range of `t0` indices in this chunk
+        j_ev,j_t0 (ndarray of int): indices of the events and `t0` for each pair in the chunk
+    """
+    n = hi-lo
+    cum = np.cumsum(n)
+    i0 = 0
+    while i0<len(n):
+        base = cum[i0-1] if i0 else 0
+        i1 = max(np.searchsorted(cum, base+chunk_size, side='right'), i0+1)
+        counts = n[i0:i1]
+        j_t0 = np.repeat(np.arange(i0,i1), counts)
+        starts = np.cumsum(counts)-counts
+        j_ev = np.arange(counts.sum())+np.repeat(lo[i0:i1]-starts, counts)
+        yield i0,i1,j_ev,j_t0
+        i0 = i1
+
 class LLR:
     """ Log likelihood ratio for H0 (B) and H1 (B+S) hypotheses:
 
@@ -40,16 +115,135 @@ class LLR:
         """
     def __init__(self, det: DetConfig):
         self.det = det
+        self._prog = None
+        self._samples = {}
+
+    def _program(self, backend):
+        """ the compiled signal rate for the kernel backend, or None for numpy backend"""
+        if backend not in ('auto','numpy','numba'):
+            raise ValueError(f'Unknown LLR backend: "{backend}"')
+        if backend=='numpy' or (backend=='auto' and not kernels.have_numba()):
+            return None
+        if self._prog is None:
+            self._prog = (kernels.compile_rate(self.det.S),)
+        prog = self._prog[0]
+        if backend=='numba':
+            if not kernels.have_numba():
+                raise ValueError('numba backend is not available: numba is not installed')
+            if prog is None:
+                raise ValueError(f'numba backend does not support the signal rate {self.det.S}, use ABCRate.compile()')
+        return prog
    
     def llr(self,ts,t0, w=1):
         if ts.size==0: 
             return np.zeros((1,len(t0)))
-        tSN = ts-np.expand_dims(t0,1)
-        res = np.log(1+self.det.S(tSN)/self.det.B(ts))*w
-        res[(tSN<self.det.time_window[0])|(tSN>self.det.time_window[1])]=0
+        with stage('LLR.llr', ts.size*len(t0)):
+            tSN = ts-np.expand_dims(t0,1)
+            res = np.log(1+self.det.S(tSN)/self.det.B(ts))*w
+            res[(tSN<self.det.time_window[0])|(tSN>self.det.time_window[1])]=0
         return res
         
-    def __call__(self,ts,t0, time_precision=None):
+    def llr_window(self, ts, t0, w=None, chunk_size=2**20, backend='auto'):
+        """
+        Calculate the cumulative LLR values, visiting only the events inside the time window of each `t0`.
+
+        The events are sorted once, and the `t0` values are processed in chunks,
+        so that the memory grows with the number of events in the windows,
+        not with `len(ts)*len(t0)`.
+
+        With the "numba" backend the loop over the events in the window of each `t0` is done
+        by the compiled kernel (see :mod:`sn_stat.kernels`), without the temporary arrays.
+        The result is equal to the "numpy" backend within the rounding errors.
+
+        Args:
+            ts (ndarray): events timestamps
+            t0 (ndarray): assumed supernova start times
+            w (ndarray or None): events weights
+            chunk_size (int): maximal number of (event, t0) pairs processed at once
+            backend ("auto", "numpy" or "numba"): the calculation backend.
+                "auto" uses numba, if it is installed and supports the signal rate
+        Returns:
+            ndarray: cumulative LLR values for each value of `t0`
+        """
+        prog = self._program(backend)
+        with stage('LLR.llr_window', ts.size):
+            return self._llr_window(prog, ts, t0, w, chunk_size)
+
+    def _llr_window(self, prog, ts, t0, w, chunk_size):
+        res = np.zeros(len(t0))
+        if ts.size==0 or len(t0)==0:
+            return res
+        order = np.argsort(ts, kind='stable')
+        ts = ts[order]
+        if w is not None:
+            w = np.broadcast_to(w, order.shape)[order]
+        lo,hi = window_bounds(ts, t0, self.det.time_window)
+        #background is evaluated once for every event in any window
+        e0, e1 = lo.min(), hi.max()
+        b = np.zeros(ts.shape)
+        b[e0:e1] = self.det.B(ts[e0:e1])
+        if prog is not None:
+            w = np.ones(ts.shape) if w is None else np.asarray(w, dtype=float)
+            return kernels.llr_window(prog, ts, b, w, np.asarray(t0, dtype=float), lo, hi, self.det.time_window)
+        for i0,i1,j_ev,j_t0 in window_chunks(lo,hi,chunk_size):
+            tSN = ts[j_ev]-t0[j_t0]
+            l = np.log(1+self.det.S(tSN)/b[j_ev])
+            if w is not None:
+                l*=w[j_ev]
+            l[(tSN<self.det.time_window[0])|(tSN>self.det.time_window[1])]=0
+            res[i0:i1] = np.bincount(j_t0-i0, weights=l, minlength=i1-i0)
+        return res
+
+    def llr_binned(self, ts, t0, time_precision=None):
+        """
+        Calculate the cumulative LLR values on the uniform `t0` grid as the correlation
+        of the events histogram with the kernel :math:`\\log(1+S(t)/B)`.
+
+        The events are grouped to the bins of the width `dt/n`, where `dt` is the `t0` grid step,
+        and `n` is the smallest integer so that the bin width doesn't exceed `time_precision`.
+        Each event is placed to the center of its bin, so the result is equal to the exact one
+        within the LLR change on the half of the bin width.
+        The correlation is calculated with :func:`scipy.signal.correlate`
+        (using FFT for the large arrays), in :math:`O(N\\log N)` for `N` bins.
+
+        The kernel doesn't depend on the event time only if the background rate is constant,
+        so the time-dependent background is not supported.
+
+        Args:
+            ts (ndarray): events timestamps
+            t0 (ndarray): assumed supernova start times: the uniform grid
+            time_precision (float or None): maximal bin width. If None - equal to the `t0` step
+        Returns:
+            ndarray: cumulative LLR values for each value of `t0`
+        Raises:
+            ValueError: if the background rate is not constant, or `t0` is not a uniform grid
+        """
+        B = _constant(self.det.B)
+        if B is None:
+            raise ValueError('Binned LLR calculation needs the constant background rate, use method="window"')
+        res = np.zeros(len(t0))
+        if len(t0)==0:
+            return res
+        dt = (t0[-1]-t0[0])/(len(t0)-1) if len(t0)>1 else (time_precision or 1)
+        if not dt>0 or not np.allclose(np.diff(t0), dt, rtol=1e-6, atol=0):
+            raise ValueError('Binned LLR calculation needs the uniform increasing t0 grid')
+        n = int(np.ceil(dt/time_precision*(1-1e-9))) if time_precision else 1
+        h = dt/n
+        tw = self.det.time_window
+        #kernel for the events in the bins m: t-t0 = (m+0.5)*h inside the time window
+        m0,m1 = int(np.ceil(tw[0]/h-0.5)), int(np.floor(tw[1]/h-0.5))
+        if m1<m0:
+            return res
+        with stage('LLR.llr_binned', ts.size):
+            kern = np.log(1+self.det.S((np.arange(m0,m1+1)+0.5)*h)/B)
+            #events histogram: bin k contains t-t0[0] in [(k+m0)*h, (k+m0+1)*h)
+            k = np.floor((ts-t0[0])/h).astype(np.int64)-m0
+            nbins = (len(t0)-1)*n+len(kern)
+            k = k[(k>=0)&(k<nbins)]
+            counts = np.bincount(k, minlength=nbins).astype(float)
+            return signal.correlate(counts, kern, mode='valid')[::n]
+
+    def __call__(self,ts,t0, time_precision=None, method='dense', chunk_size=2**20, backend='auto'):
         """
         Calculate the LLR value for given set of measurements `ts`, assuming supernova times `t0`
 
@@ -62,6 +256,16 @@ class LLR:
         time_precision: float or `None`
             If not None: group the given `ts` to the time bins with given precision, 
             speeding up the calculation for large number of events
+        method: "dense", "window" or "binned"
+            If "dense", evaluate the LLR for every pair of event and `t0`;
+            if "window", use the sliding window over the sorted events (see :meth:`llr_window`),
+            which needs much less memory for long datasets;
+            if "binned", correlate the events histogram with the LLR kernel (see :meth:`llr_binned`).
+            This needs the uniform `t0` grid and the constant background
+        chunk_size: int
+            Maximal number of (event, t0) pairs processed at once (only for `method="window"`)
+        backend: "auto", "numpy" or "numba"
+            Calculation backend for `method="window"` (see :meth:`llr_window`)
 
         returns
         -------
@@ -71,30 +275,85 @@ class LLR:
         """
         ts = np.array(ts, ndmin=1)
         t0 = np.array(t0, ndmin=1)
+        if method=='binned':
+            return self.llr_binned(ts,t0,time_precision)
         if(time_precision):
             t,w = w,t = np.histogram(ts,bins=np.arange(ts.min(),ts.max(),time_precision))
             tc = 0.5*(t[1:]+t[:-1])
             tc = tc[w>0]
             w = w[w>0]
-            res = self.llr(tc,t0,w)
         else:
-            res = self.llr(ts,t0)
+            tc,w = ts,None
+        if method=='window':
+            return self.llr_window(tc,t0,w,chunk_size=chunk_size,backend=backend)
+        elif method!='dense':
+            raise ValueError(f'Unknown LLR calculation method: "{method}"')
+        res = self.llr(tc,t0) if w is None else self.llr(tc,t0,w)
         return np.sum(res, axis=1)
 
-    def sample(self,hypothesis, Nsamples,t0):
-        #sample the LLR with hypothesis
-        ts = np.linspace(*self.det.time_window,Nsamples)+t0
+    def sample_points(self, Nsamples, t0, sampling='uniform', ltol=1e-3):
+        """
+        Sample the LLR in the time window. The samples are memoised for the last used arguments.
+
+        Args:
+            Nsamples (int): number of points for the "uniform" sampling, maximal number of points for "adaptive"
+            t0 (float): assumed supernova start time
+            sampling ("uniform" or "adaptive"):
+                "uniform" - equidistant points,
+                "adaptive" - the intervals of the coarse grid are bisected, while the LLR in the middle point
+                differs from the linear interpolation by more than `ltol*max(l)`
+            ltol (float): relative LLR precision for the "adaptive" sampling
+        Returns:
+            (ts, ls) - the time points and LLR values in them, independent of the hypothesis
+        """
+        key = (Nsamples, float(t0), sampling, ltol)
+        if key not in self._samples:
+            if sampling=='uniform':
+                ts = np.linspace(*self.det.time_window,Nsamples)+t0
+                with stage('LLR.sample', Nsamples):
+                    ls = self.llr(ts,t0=[t0]).flatten()
+            elif sampling=='adaptive':
+                with stage('LLR.sample', Nsamples):
+                    ts,ls = self._sample_adaptive(Nsamples, t0, ltol)
+            else:
+                raise ValueError(f'Unknown LLR sampling method: "{sampling}"')
+            if len(self._samples)>=16:
+                self._samples.clear()
+            self._samples[key] = (ts,ls)
+        return self._samples[key]
+
+    def _sample_adaptive(self, Nsamples, t0, ltol, ninit=257):
+        ts = np.linspace(*self.det.time_window,min(ninit,Nsamples))+t0
         ls = self.llr(ts,t0=[t0]).flatten()
+        tol = ltol*np.max(np.abs(ls), initial=0)
+        #intervals to bisect: the left ends
+        todo = np.arange(len(ts)-1)
+        while len(todo) and len(ts)<Nsamples:
+            todo = todo[:Nsamples-len(ts)]
+            tm = 0.5*(ts[todo]+ts[todo+1])
+            lm = self.llr(tm,t0=[t0]).flatten()
+            err = np.abs(lm-0.5*(ls[todo]+ls[todo+1]))
+            #both halves are bisected further, if the interval is not linear enough (and not too short)
+            bad = (err>tol)&(tm>ts[todo])&(tm<ts[todo+1])
+            pos = todo+np.arange(1,len(todo)+1)
+            ts = np.insert(ts, todo+1, tm)
+            ls = np.insert(ls, todo+1, lm)
+            todo = np.sort(np.concatenate([pos[bad]-1, pos[bad]]))
+        return ts,ls
+
+    def sample(self,hypothesis, Nsamples,t0, sampling='uniform'):
+        #sample the LLR with hypothesis
+        ts,ls = self.sample_points(Nsamples,t0,sampling)
         ws = hypothesis(ts)
         return ls,ws
-    def l_range(self, t0, Nsamples=10000):
+    def l_range(self, t0, Nsamples=10000, sampling='uniform'):
         """
         returns: (min, max) LLR values for given t0
         """
-        ls,_ = self.sample(hypothesis=self.det.B, Nsamples=Nsamples, t0=t0)
+        ls,_ = self.sample(hypothesis=self.det.B, Nsamples=Nsamples, t0=t0, sampling=sampling)
         return min(ls),max(ls)
     
-    def distr(self, hypothesis='H0', t0=0, *, normal=False, Nsamples=10000, dl='auto'):
+    def distr(self, hypothesis='H0', t0=0, *, normal=False, Nsamples=10000, dl='auto', sampling='uniform'):
         """
         Calculate the LLR distribution under given assumption of the event rate
 
@@ -118,6 +377,11 @@ class LLR:
             Nsamples(int):
                 number of points to sample the LLR values range
                 (ignored if `normal==True`)
+            sampling("uniform" or "adaptive"):
+                the LLR sampling method (see :meth:`sample_points`).
+                With "adaptive" sampling the LLR is linearly interpolated between the points,
+                and the weight of each interval (the trapezoid integral of the hypothesis rate)
+                is distributed over the bins, covered by its LLR values
 
         Returns:
             distribution of the LLR values. 
@@ -126,23 +390,232 @@ class LLR:
         """
         if hypothesis=='H0':
             hypothesis=self.det.B
-        ls,ws = self.sample(hypothesis,Nsamples,t0)
-        if normal:
-            ws/=ws.sum()
-            mu  = ls@ws
-            var = (ls**2)@ws-mu**2
-            var = max(var,1e-16)
-            return stats.norm(loc=mu,scale=np.sqrt(var))
-        # define the binning 
-        if dl=='auto':
-            dl=ls.max()*1e-3
-        binsl = np.arange(0,ls.max()+2*dl,dl)-dl/2.
-        # produce the distribution
+        ts,ls = self.sample_points(Nsamples,t0,sampling)
+        ws = np.broadcast_to(hypothesis(ts), ts.shape)
+        return _sampled_distr(ls, ws, normal, dl, ts if sampling=='adaptive' else None)
+
+def _trapezoid_weights(ts):
+    """ weights of the trapezoid rule for the points `ts` """
+    dt = np.diff(ts)
+    return 0.5*(np.append(dt,0)+np.insert(dt,0,0))
+
+def _interval_histogram(ls, ws, ts, bins):
+    """
+    histogram of the LLR, linearly interpolated between the points `ts`, with the rate `ws` in them:
+    the trapezoid integral of each interval is distributed over the bins proportionally to their overlap
+    with the LLR values range of the interval
+    """
+    mass = 0.5*(ws[1:]+ws[:-1])*np.diff(ts)
+    lo, hi = np.minimum(ls[1:],ls[:-1]), np.maximum(ls[1:],ls[:-1])
+    b0 = np.clip(np.searchsorted(bins, lo, side='right')-1, 0, len(bins)-2)
+    b1 = np.clip(np.searchsorted(bins, hi, side='right')-1, 0, len(bins)-2)
+    #expand each interval to the bins it covers
+    n = b1-b0+1
+    j = np.repeat(np.arange(len(n)), n)
+    k = b0[j]+np.arange(len(j))-np.repeat(np.cumsum(n)-n, n)
+    width = hi[j]-lo[j]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = (np.minimum(hi[j],bins[k+1])-np.maximum(lo[j],bins[k]))/width
+    frac = np.where(width>0, frac, 1)
+    return np.bincount(k, weights=mass[j]*frac, minlength=len(bins)-1)
+
+def _sampled_distr(ls, ws, normal, dl, ts=None):
+    """
+    LLR distribution from the LLR values `ls` with weights `ws` (see :meth:`LLR.distr`).
+    If the points `ts` are given, the LLR and the rate are linearly interpolated between them
+    """
+    if normal:
+        if ts is not None:
+            ws = ws*_trapezoid_weights(ts)
+        ws = ws/ws.sum()
+        mu  = ls@ws
+        var = (ls**2)@ws-mu**2
+        var = max(var,1e-16)
+        return stats.norm(loc=mu,scale=np.sqrt(var))
+    # define the binning
+    if dl=='auto':
+        dl=ls.max()*1e-3
+    binsl = np.arange(0,ls.max()+2*dl,dl)-dl/2.
+    # produce the distribution
+    if ts is None:
         H1, binl = np.histogram(ls, weights=ws, bins=binsl, density=False)
-        H1/=H1.sum()
-        return Distr(bins = binl, vals=H1)
-    
-def JointDistr(llrs, hypos='H0', t0=0, R_threshold=100, *, dl=1e-3, epsilon=1e-16, Nsamples=10000):
+    else:
+        H1, binl = _interval_histogram(ls, ws, ts, binsl), binsl
+    H1/=H1.sum()
+    return Distr(bins = binl, vals=H1)
+
+def fft_support(hists, R, epsilon, nbins_max):
+    """
+    Estimate the number of bins, containing all but `epsilon` of the compound Poisson distribution:
+    the sum of Poisson(`R[i]`) random values, distributed with histograms `hists[i]`.
+
+    The initial estimate is taken from the mean and variance of the distribution.
+    It is doubled, while the Chernoff bound on the tail mass above it exceeds `epsilon`.
+
+    Args:
+        hists (list of ndarray): normalized histograms for each component
+        R (ndarray): expected number of values for each component
+        epsilon (float): allowed tail mass
+        nbins_max (int): the maximal number of bins to return
+    Returns:
+        int: number of bins
+    """
+    ks = [np.arange(len(h)) for h in hists]
+    mean = sum(r*(k@h) for r,k,h in zip(R,ks,hists))
+    var  = sum(r*((k**2)@h) for r,k,h in zip(R,ks,hists))
+    #log of the moment generating function on the grid of theta values
+    with np.errstate(over='ignore', invalid='ignore'):
+        logM = sum(r*(np.exp(special.logsumexp(np.outer(_THETA,k), b=h, axis=1))-1)
+                   for r,k,h in zip(R,ks,hists))
+    return _support_size(mean, var, logM, max(len(h) for h in hists), epsilon, nbins_max)
+
+#grid of the moment generating function arguments for the Chernoff bound
+_THETA = np.logspace(-6,0,121)
+
+def _support_size(mean, var, logM, nh, epsilon, nbins_max):
+    """ the search of :func:`fft_support`, with the moments and log of the MGF on `_THETA` grid """
+    n = int(mean+stats.norm.isf(epsilon)*np.sqrt(var))+nh
+    while n<nbins_max:
+        #Chernoff bound: P(X>=n) <= exp(logM(theta)-theta*n)
+        log_tail = np.nanmin(logM-_THETA*n)
+        if log_tail<np.log(epsilon):
+            return n
+        n*=2
+    return nbins_max
+
+def _norm_distr(distrs, R):
+    if len(distrs)==0:
+        return None
+    mu  = np.array([d.mean() for d in distrs])
+    var = np.array ([d.var()  for d in distrs])
+    return stats.norm(loc=mu@R,scale=np.sqrt((mu**2+var)@R))
+
+def _fft_distr(distrs, R, dl, epsilon, adaptive):
+    if len(distrs)==0:
+        return None
+    #determine the resulting number of bins as a maximum of
+    Ns = 2*stats.poisson.isf(mu=R,q=epsilon)
+    npoints = Ns*np.array([len(H1.vals)-1 for H1 in distrs])
+    nbins = int(npoints.sum())+1
+    if adaptive:
+        nbins = fft_support([H1.vals for H1 in distrs], R, epsilon, nbins_max=nbins)
+
+    # calculate fourier transform of the real histograms, padded to the fast length
+    nfft = fft.next_fast_len(nbins, real=True)
+    Hz = np.array([fft.rfft(H1.vals, n=nfft) for H1 in distrs])
+
+    FF = np.exp(R@(Hz-1))
+    vals = fft.irfft(FF, n=nfft)[:nbins]
+    vals[vals<epsilon]=0
+
+    res = Distr(vals = vals,
+                bins = (np.arange(nbins+1)-0.5)*dl)
+    res.set_interpolation()
+    return res
+
+def _combine_distrs(*ds, epsilon, combine='fft', Nbins=1000):
+    #remove "None" histos
+    ds = [d for d in ds if d is not None]
+    if(len(ds)==1):
+        return ds[0] #only one distr
+    if combine=='lazy':
+        norm,distr = ds
+        return NormConvDistr(distr, loc=norm.mean(), scale=norm.std())
+    if combine!='fft':
+        raise ValueError(f'Unknown distributions combination method: "{combine}"')
+
+    #get ranges
+    l_min = np.array([d.isf(1-epsilon) for d in ds])
+    l_max = np.array([d.isf(epsilon) for d in ds])
+    #calc bin size
+    dl = np.min(l_max-l_min)/Nbins
+
+    #calculate histograms
+    hs = [-np.diff(d.sf(np.arange(l0,l1,dl))) for l0,l1,d in zip(l_min,l_max,ds)]
+
+    #convolution
+    h = np.maximum(signal.fftconvolve(*hs), 0)
+    b = np.arange(len(h)+1)*dl + np.sum(l_min)
+    return Distr(b,h)
+
+#the normal distribution tail beyond this number of sigmas is below 2e-33
+_NSIGMA = 12
+
+class NormConvDistr:
+    """
+    Exact distribution of the sum of the discrete (:class:`Distr`) and the normal random values.
+
+    The discrete values are the bin centers of the `distr`, so the survival function is
+    the weighted sum of the normal survival functions. It is evaluated only at the requested points,
+    using only the bins within `12*scale` from each of them (the others contribute 0 or 1,
+    with the absolute error below 2e-33). The `isf` is calculated by the bisection.
+
+    Args:
+        distr (:class:`Distr`): the discrete distribution
+        loc (float), scale(float): the normal distribution parameters
+    """
+    def __init__(self, distr, loc, scale):
+        self.distr = distr
+        self.loc = float(loc)
+        self.scale = float(scale)
+        c = 0.5*(distr.bins[1:]+distr.bins[:-1])
+        nz = distr.vals>0
+        self._c, self._v = c[nz], distr.vals[nz]
+        self._tail = np.append(np.cumsum(self._v[::-1])[::-1], 0)
+
+    def _sum(self, l, f, tail, chunk_size=2**22):
+        """ sum of `v*f(x)` over the bins within _NSIGMA of `l`, x=(l-loc-c)/scale; plus `tail` weight of the bins above them """
+        l = np.asarray(l, dtype=float)
+        x = np.ravel(l)-self.loc
+        #sorted points are processed in blocks, with the dense matrix for the union of their windows
+        order = np.argsort(x)
+        x = x[order]
+        lo = np.searchsorted(self._c, x-_NSIGMA*self.scale, side='left')
+        hi = np.searchsorted(self._c, x+_NSIGMA*self.scale, side='right')
+        res = np.zeros(x.shape)
+        i0 = 0
+        while i0<len(x):
+            cost = np.arange(1,len(x)-i0+1)*(hi[i0:]-lo[i0])
+            i1 = i0+max(1, np.searchsorted(cost, chunk_size, side='right'))
+            a, b = lo[i0], hi[i1-1]
+            M = f((x[i0:i1,None]-self._c[None,a:b])/self.scale)
+            res[i0:i1] = M@self._v[a:b]+(self._tail[b] if tail else 0)
+            i0 = i1
+        res[order] = res.copy()
+        return res.reshape(l.shape)[()]
+
+    def sf(self, l):
+        "survival function"
+        return self._sum(l, lambda x: special.ndtr(-x), tail=True)
+    def cdf(self, l):
+        "cumulative distribution function"
+        return 1-self.sf(l)
+    def pdf(self, l):
+        "probability density function"
+        return self._sum(l, lambda x: np.exp(-0.5*x**2)/np.sqrt(2*np.pi)/self.scale, tail=False)
+    def isf(self, p):
+        "inverse survival function"
+        p = np.asarray(p, dtype=float)
+        a = np.full(p.shape, self._c[0]+self.loc-_NSIGMA*self.scale)
+        b = np.full(p.shape, self._c[-1]+self.loc+_NSIGMA*self.scale)
+        for it in range(100):
+            m = 0.5*(a+b)
+            if np.all((m==a)|(m==b)):
+                break
+            above = self.sf(m)>p
+            a, b = np.where(above, m, a), np.where(above, b, m)
+        return b[()]
+    def mean(self):
+        return self._v@self._c+self.loc
+    def var(self):
+        return self._v@self._c**2-(self._v@self._c)**2+self.scale**2
+    def std(self):
+        return np.sqrt(self.var())
+    def __repr__(self):
+        return f'{__class__}(distr={self.distr}, loc={self.loc}, scale={self.scale})'
+
+def JointDistr(llrs, hypos='H0', t0=0, R_threshold=100, *, dl=1e-3, epsilon=1e-16, Nsamples=10000, adaptive=True,
+               combine='fft', sampling='uniform'):
     """
     Calculate the joint distribution of `llrs` under hypotheses `hypos`
 
@@ -166,88 +639,230 @@ def JointDistr(llrs, hypos='H0', t0=0, R_threshold=100, *, dl=1e-3, epsilon=1e-1
             calculation precision for FFT distributions
             (ignored if all distrs are gaussian)
         Nsamples(int):
-            number of points to sample the LLR values range
-            (ignored if all distrs are gaussian)
+            number of points to sample the LLR values range (the maximal number for the "adaptive" sampling)
+        sampling("uniform" or "adaptive"):
+            the LLR sampling method (see :meth:`LLR.sample_points` and :meth:`LLR.distr`).
+            The "adaptive" sampling uses the relative LLR precision `dl`
+        adaptive(bool):
+            if True, cut the FFT grid to the support of the distribution (see :func:`fft_support`),
+            otherwise use the grid for the maximal number of events
+        combine("fft" or "lazy"):
+            the combination of the gaussian and FFT distributions, if there are both:
+            "fft" - :class:`Distr` with the convolution of the histograms with `scipy.signal.fftconvolve`,
+            "lazy" - the exact :class:`NormConvDistr` (without the binning error, but slower to evaluate)
     
     Returns:
-        :class:`Distr`: 
+        :class:`Distr` or :class:`NormConvDistr` or :class:`scipy.stats.norm`:
             a distribution for the joint (sum) of individual LLRs under the given hypothesis
     """
-    def NormDistr(distrs,R):
-        if len(distrs)==0:
-            return None
-        mu  = np.array([d.mean() for d in distrs])
-        var = np.array ([d.var()  for d in distrs])
-        return stats.norm(loc=mu@R,scale=np.sqrt((mu**2+var)@R))
+    return JointDistrBatch(llrs, [hypos], t0, R_threshold, workers=1, dl=dl, epsilon=epsilon,
+                           Nsamples=Nsamples, adaptive=adaptive, combine=combine, sampling=sampling)[0]
 
-    def FFTDistr(distrs, R, t0=0, dl=1e-3):
-        if len(distrs)==0:
-            return None
-        #determine the resulting number of bins as a maximum of 
-        Ns = 2*stats.poisson.isf(mu=R,q=epsilon)
-        npoints = Ns*np.array([len(H1.vals)-1 for H1 in distrs])
-        nbins = int(npoints.sum())+1
-
-        # calculate fourier transform
-        Hz = [fft.fft(H1.vals, n=nbins) for H1 in distrs]
-        Hz = np.array(Hz)
-
-        FF = np.exp(R@(np.array(Hz)-1))
-        vals =  np.real(fft.ifft(FF))
-        vals[vals<epsilon]=0
-        
-        res = Distr(vals = vals,
-                    bins = (np.arange(nbins+1)-0.5)*dl)
-        res.set_interpolation()
-        return res
+def JointDistrBatch(llrs, hypos_list, t0=0, R_threshold=100, workers=None, *,
+                    dl=1e-3, epsilon=1e-16, Nsamples=10000, adaptive=True, combine='fft', sampling='uniform',
+                    scaled='auto'):
+    """
+    Calculate the joint distributions of `llrs` for many hypotheses (i.e. for the sensitivity vs. distance).
 
-    def combine_distrs(*ds,Nbins=1000):
-        #remove "None" histos
-        ds = [d for d in ds if d is not None]
-        if(len(ds)==1):
-            return ds[0] #only one distr
-
-        #get ranges
-        l_min = np.array([d.isf([1-epsilon]) for d in ds])
-        l_max = np.array([d.isf([epsilon]) for d in ds])
-        #calc bin size
-        dl = np.min(l_max-l_min)/Nbins
-
-        #calculate histograms
-        bs = []
-        hs = []
-
-        for l0,l1,d in zip(l_min,l_max,ds):
-            bins = np.arange(l0,l1,dl)
-            h = -np.diff(d.sf(bins))
-            bs+=[bins]
-            hs+=[h]
-
-        #convolution
-        h = np.convolve(*hs)
-        b = np.arange(len(h)+1)*dl + np.sum(l_min)
-        res = Distr(b,h)
-        res.set_interpolation()
-        return res
-    
-    if hypos=='H0':
-        hypos = [l.det.B for l in llrs]
-    #prepare the rates for each experiment
-    R = np.array([h.integral(*l.det.time_window+t0) for l,h in zip(llrs,hypos)])
-   
-    #divide small and large R cases
-    largeR = (R>=R_threshold)
-    smallR = largeR==False
-    #prepare the distributions for each experiment)
-    if np.any(smallR):
-        llr_max = [l.l_range(t0=t0)[1] for l in np.array(llrs)[smallR]]
-        llr_max = max(llr_max)
-        llr_step=dl*llr_max
-    else:
-        llr_step=dl
- 
-    H1s=np.array([l.distr(h,t0,dl=llr_step,normal=is_norm,Nsamples=Nsamples) for l,h,is_norm in zip(llrs,hypos, largeR)])
-    d1 = NormDistr(H1s[largeR], R[largeR])
-    d2 = FFTDistr (H1s[smallR], R[smallR],dl=llr_step)
-    return combine_distrs(d1,d2)
+    The LLR values on the sampling grid don't depend on the hypothesis, so they are calculated once
+    for each detector, and only the weights (the hypothesis rate on the grid) are calculated for each hypothesis.
+    The distributions are constructed in the thread pool.
+    The result is equal to calling :func:`JointDistr` for each hypothesis.
 
+    If the hypotheses are the linear combinations of the same rates (i.e. `Signal.at(d)` for many `d`,
+    optionally plus the background), the scale family shortcut can be used:
+    the rates are decomposed through the products with constants and sums, and the integrals,
+    the LLR histograms and their Fourier transforms are calculated once for each of the common rates.
+    Then the distributions for all hypotheses are calculated with a single batched exponentiation
+    and inverse FFT. The result is equal to :func:`JointDistr` within the rounding errors and `epsilon`.
+
+    Args:
+        llrs (iterable of :class:`LLR`):
+            configurations for each experiment
+        hypos_list (iterable of hypotheses):
+            hypotheses (see :func:`JointDistr`): list of rates for each experiment, or "H0"
+        t0, R_threshold: see :func:`JointDistr`
+        workers (int or None): number of threads
+
+    Keyword Args:
+        dl, epsilon, Nsamples, adaptive, combine, sampling: see :func:`JointDistr`
+        scaled (bool or "auto"): use the scale family shortcut.
+            If "auto" - use it if the hypotheses have the common rates for any experiment
+
+    Returns:
+        list of :class:`Distr`: distributions for each hypothesis
+    """
+    llrs = list(llrs)
+    hypos_list = [[l.det.B for l in llrs] if isinstance(h, str) and h=='H0' else list(h) for h in hypos_list]
+    with stage('JointDistrBatch', len(hypos_list)):
+        return _joint_distr_batch(llrs, hypos_list, t0, R_threshold, workers, dl, epsilon, Nsamples, adaptive,
+                                  combine, sampling, scaled)
+
+def _joint_distr_batch(llrs, hypos_list, t0, R_threshold, workers, dl, epsilon, Nsamples, adaptive, combine, sampling,
+                       scaled):
+    if scaled=='auto':
+        scaled = len(hypos_list)>1 and any(
+            len({id(r) for hypos in hypos_list for c,r in _linear_terms(hypos[n])})<len(hypos_list)
+            for n in range(len(llrs)))
+    interp = sampling=='adaptive'
+    if scaled:
+        points = [l.sample_points(Nsamples, t0, sampling, ltol=dl) for l in llrs]
+        return _scaled_distrs(llrs, hypos_list, points, t0, R_threshold, dl, epsilon, adaptive, combine, interp)
+    #LLR values on the sampling grid of each experiment (calculated on the first use)
+    points = {}
+    def _points(n):
+        if n not in points:
+            points[n] = llrs[n].sample_points(Nsamples, t0, sampling, ltol=dl)
+        return points[n]
+
+    def _make(hypos):
+        #prepare the rates for each experiment
+        with stage('JointDistr.integrals', len(llrs)):
+            R = np.array([h.integral(*l.det.time_window+t0) for l,h in zip(llrs,hypos)])
+        #divide small and large R cases
+        largeR = (R>=R_threshold)
+        smallR = largeR==False
+        #prepare the distributions for each experiment
+        if np.any(smallR):
+            llr_max = max(_points(n)[1].max() for n in np.flatnonzero(smallR))
+            llr_step=dl*llr_max
+        else:
+            llr_step=dl
+        H1s = []
+        for n,(h,is_norm) in enumerate(zip(hypos, largeR)):
+            ts,ls = _points(n)
+            with stage('JointDistr.histograms', len(ts)):
+                H1s += [_sampled_distr(ls, h(ts), is_norm, llr_step, ts if interp else None)]
+        H1s = np.array(H1s, dtype=object)
+        with stage('JointDistr.norm', np.count_nonzero(largeR)):
+            d1 = _norm_distr(H1s[largeR], R[largeR])
+        with stage('JointDistr.fft', sum(len(H1.vals) for H1 in H1s[smallR])):
+            d2 = _fft_distr(H1s[smallR], R[smallR], llr_step, epsilon, adaptive)
+        with stage('JointDistr.combine'):
+            return _combine_distrs(d1, d2, epsilon=epsilon, combine=combine)
+
+    if workers==1 or len(hypos_list)<2:
+        return [_make(h) for h in hypos_list]
+    #the samples are shared by all the hypotheses: calculate them before starting the threads
+    for n in range(len(llrs)):
+        _points(n)
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(_make, hypos_list))
+
+def _linear_terms(r, C=1.):
+    """ decompose the rate through the products with constants and sums: list of (C, rate) """
+    if isinstance(r, _mul):
+        return _linear_terms(r._r0, C*r.C)
+    if isinstance(r, _sum):
+        return _linear_terms(r.r0, C)+_linear_terms(r.r1, C)
+    return [(C, r)]
+
+def _scaled_distrs(llrs, hypos_list, points, t0, R_threshold, dl, epsilon, adaptive, combine, interp, max_size=2**22):
+    """
+    Scale family shortcut for :func:`JointDistrBatch`: each hypothesis is decomposed into the linear
+    combination of the common rates, and the compound Poisson characteristic function is combined
+    from the transforms of the common rates histograms for all the hypotheses at once
+    (in chunks of at most `max_size` frequencies).
+    If `interp`, the LLR and the rates are linearly interpolated between the sampling points (see :meth:`LLR.distr`)
+    """
+    nhyp = len(hypos_list)
+    #the common rates for each experiment, and their coefficients C[n] with shape (nhyp, nrates)
+    bases, C = [], []
+    for n in range(len(llrs)):
+        idx, rates, coefs = {}, [], []
+        for hypos in hypos_list:
+            row = {}
+            for c,r in _linear_terms(hypos[n]):
+                if id(r) not in idx:
+                    idx[id(r)] = len(rates)
+                    rates += [r]
+                row[idx[id(r)]] = row.get(idx[id(r)],0)+c
+            coefs += [row]
+        Cn = np.zeros((nhyp,len(rates)))
+        for i,row in enumerate(coefs):
+            Cn[i,list(row)] = list(row.values())
+        bases += [rates]
+        C += [Cn]
+    #integrals and the weights on the sampling grid of the common rates
+    with stage('JointDistr.integrals', nhyp*len(llrs)):
+        R = np.stack([Cn@[r.integral(*l.det.time_window+t0) for r in rates]
+                      for l,rates,Cn in zip(llrs,bases,C)], axis=1)
+        W = [np.array([np.broadcast_to(r(ts), ts.shape) for r in rates]) for rates,(ts,ls) in zip(bases,points)]
+    largeR = (R>=R_threshold)
+    res = [None]*nhyp
+    #the hypotheses with the same set of the gaussian experiments share the LLR binning
+    patterns, inverse = np.unique(largeR, axis=0, return_inverse=True)
+    for p,pattern in enumerate(patterns):
+        hs = np.flatnonzero(np.ravel(inverse)==p)
+        d1 = [None]*len(hs)
+        d2 = [None]*len(hs)
+        if np.any(pattern):
+            with stage('JointDistr.norm', len(hs)*np.count_nonzero(pattern)):
+                loc, var = np.zeros(len(hs)), np.zeros(len(hs))
+                for n in np.flatnonzero(pattern):
+                    ts,ls = points[n]
+                    c = C[n][hs]
+                    Wn = W[n]*_trapezoid_weights(ts) if interp else W[n]
+                    w0 = c@Wn.sum(axis=1)
+                    mu = c@(Wn@ls)/w0
+                    sigma2 = np.maximum(c@(Wn@ls**2)/w0-mu**2, 1e-16)
+                    loc += mu*R[hs,n]
+                    var += (mu**2+sigma2)*R[hs,n]
+                d1 = [stats.norm(loc=m,scale=np.sqrt(v)) for m,v in zip(loc,var)]
+        small = np.flatnonzero(~pattern)
+        if len(small):
+            llr_step = dl*max(points[n][1].max() for n in small)
+            with stage('JointDistr.histograms', sum(len(W[n])*len(points[n][0]) for n in small)):
+                #histograms of the common rates, and their normalization for each hypothesis
+                hists, norms = [], []
+                for n in small:
+                    ts,ls = points[n]
+                    binsl = np.arange(0,ls.max()+2*llr_step,llr_step)-llr_step/2.
+                    if interp:
+                        hists += [np.array([_interval_histogram(ls, w, ts, binsl) for w in W[n]])]
+                    else:
+                        hists += [np.array([np.histogram(ls, weights=w, bins=binsl)[0] for w in W[n]])]
+                    norms += [C[n][hs]@hists[-1].sum(axis=1)]
+            with stage('JointDistr.fft', len(hs)*sum(h.shape[1] for h in hists)):
+                Rs = R[np.ix_(hs,small)]
+                Ns = 2*stats.poisson.isf(mu=Rs,q=epsilon)
+                nbins = (Ns@[h.shape[1]-1 for h in hists]).astype(int)+1
+                if adaptive:
+                    #moments and the MGF of the combined histograms
+                    mean, var, logM = 0, 0, 0
+                    for h,n,s in zip(hists,small,norms):
+                        k = np.arange(h.shape[1])
+                        c = C[n][hs]/s[:,None]
+                        mean = mean+R[hs,n]*(c@(h@k))
+                        var = var+R[hs,n]*(c@(h@k**2))
+                        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+                            L = special.logsumexp(np.outer(_THETA,k), b=h[:,None,:], axis=-1)
+                            logM = logM+R[hs,n,None]*(np.exp(special.logsumexp(L, b=c[:,:,None], axis=1))-1)
+                    nh = max(h.shape[1] for h in hists)
+                    nbins = np.array([_support_size(mean[i], var[i], logM[i], nh, epsilon, nbins[i])
+                                      for i in range(len(hs))])
+                #chunks of the hypotheses with the increasing number of bins
+                order = np.argsort(nbins, kind='stable')
+                i0 = 0
+                while i0<len(order):
+                    i1 = i0+1
+                    while i1<len(order) and (i1-i0+1)*fft.next_fast_len(int(nbins[order[i1]]), real=True)<=max_size:
+                        i1 += 1
+                    chunk = order[i0:i1]
+                    nfft = fft.next_fast_len(int(nbins[chunk[-1]]), real=True)
+                    #log of the characteristic function: R*(H(z)-1), summed over the experiments
+                    E = -Rs[chunk].sum(axis=1)[:,None]
+                    for h,n,s in zip(hists,small,norms):
+                        Hz = fft.rfft(h, n=nfft, axis=-1)
+                        E = E+((R[hs[chunk],n]/s[chunk])[:,None]*C[n][hs[chunk]])@Hz
+                    vals = fft.irfft(np.exp(E, out=E), n=nfft, axis=-1)
+                    for i,v in zip(chunk, vals):
+                        v = v[:nbins[i]].copy()
+                        v[v<epsilon]=0
+                        d2[i] = Distr(vals=v, bins=(np.arange(nbins[i]+1)-0.5)*llr_step)
+                        d2[i].set_interpolation()
+                    i0 = i1
+        with stage('JointDistr.combine', len(hs)):
+            for i,h in enumerate(hs):
+                res[h] = _combine_distrs(d1[i], d2[i], epsilon=epsilon, combine=combine)
+    return res
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from .sig_calc import scan_llrs
+
+#the state of the worker process, set by the pool initializer
+_worker = {}
+
+def get_context():
+    """ multiprocessing context for the pools: "fork" if available,
+    so the analysis objects (with arbitrary rate functions) don't need to be pickled
+    """
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return mp.get_context()
+
+def make_pool(workers, initializer=None, initargs=()):
+    """ create the process pool with `workers` processes (all CPUs if None) """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=get_context(),
+                               initializer=initializer, initargs=initargs)
+
+class SharedArrays:
+    """
+    Copy of the arrays in the shared memory, which can be attached by the worker processes
+    without pickling the data.
+
+    Args:
+        arrays (iterable of ndarray): the arrays to share
+
+    Attributes:
+        descr (list): the descriptions (name, shape, dtype) of the shared arrays to pass to :func:`attach`
+    """
+    def __init__(self, arrays):
+        #multiprocessing.shared_memory is available since python 3.8
+        from multiprocessing import shared_memory
+        self._shm = []
+        self.descr = []
+        for a in arrays:
+            a = np.ascontiguousarray(a)
+            shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes,1))
+            np.ndarray(a.shape, a.dtype, buffer=shm.buf)[...] = a
+            self._shm += [shm]
+            self.descr += [(shm.name, a.shape, a.dtype.str)]
+
+    def close(self):
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def attach(descr):
+    """ attach the arrays, shared by :class:`SharedArrays` in the worker process
+
+    Returns:
+        list of ndarray: the shared arrays
+    """
+    from multiprocessing import shared_memory
+    res = []
+    for name, shape, dtype in descr:
+        shm = shared_memory.SharedMemory(name=name)
+        _worker.setdefault('shm',[]).append(shm)
+        res += [np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)]
+    return res
+
+def _init_scan(llrs, data_descr, t0_descr):
+    _worker['llrs'] = llrs
+    _worker['data'] = attach(data_descr)
+    _worker['t0'] = attach([t0_descr])[0]
+
+def _scan_task(dets, i0, i1, params):
+    return scan_llrs([_worker['llrs'][i] for i in dets],
+                     [_worker['data'][i] for i in dets],
+                     _worker['t0'][i0:i1], **params)
+
+def parallel_scan(llrs, data, t0, workers=None, shard='both', nchunks=None, **params):
+    """
+    Calculate the LLR values for each detector in the process pool.
+
+    The events and `t0` arrays are copied to the shared memory once,
+    and the tasks, sharding the detectors and/or the `t0` grid, are sent to the workers.
+    The results are collected in the deterministic order, and are identical
+    to the single process calculation.
+
+    Args:
+        llrs (list of :class:`LLR`): the LLR objects for each detector
+        data (list of ndarray): events timestamps for each detector
+        t0 (ndarray): assumed signal start times
+        workers (int or None): number of processes. If None - use all CPUs
+        shard ("t0", "det" or "both"): split the calculation by `t0` chunks, by detectors, or both
+        nchunks (int or None): number of `t0` chunks. If None - equal to the number of workers
+
+    Keyword Args:
+        params (dict of kwargs): parameters to pass to :meth:`LLR.__call__`
+
+    Returns:
+        ndarray: LLR values with shape `(len(llrs), len(t0))`
+    """
+    if shard not in ('t0','det','both'):
+        raise ValueError(f'Unknown sharding mode: "{shard}"')
+    workers = workers or os.cpu_count()
+    t0 = np.asarray(t0, dtype=float)
+    data = [np.asarray(d, dtype=float) for d in data]
+    nchunks = 1 if shard=='det' else (nchunks or workers)
+    edges = np.linspace(0, len(t0), nchunks+1).astype(int)
+    groups = [[i] for i in range(len(llrs))] if shard!='t0' else [list(range(len(llrs)))]
+    res = np.zeros((len(llrs),len(t0)))
+    with SharedArrays(data) as sd, SharedArrays([t0]) as st:
+        with make_pool(workers, _init_scan, (llrs, sd.descr, st.descr[0])) as pool:
+            tasks = {(tuple(g),i0,i1):pool.submit(_scan_task, g, i0, i1, params)
+                     for g in groups for i0,i1 in zip(edges[:-1],edges[1:]) if i1>i0}
+            for (g,i0,i1),task in tasks.items():
+                res[list(g),i0:i1] = task.result()
+    return res
@@ -0,0 +1,209 @@
+"""
+Stage level profiling of the sn_stat calculations.
+
+The main calculation stages (LLR evaluation and sampling, :func:`sn_stat.llr.JointDistr` steps,
+the events sampling, the significance conversion and the rate integrals) are instrumented with :func:`stage` or :func:`profiled`.
+The instrumentation is disabled by default, and then costs only a function call for each stage (under a microsecond).
+
+It is enabled with the :func:`profile` context manager::
+
+    with sn_stat.profiling.profile() as report:
+        ana = sn.ShapeAnalysis(dets)
+        ana(data, t0)
+    print(report)
+    log.info(report.to_dict())
+
+or for the whole process with `SN_STAT_PROFILE` environment variable: the report is accessible with :func:`report`
+and is printed to stderr on the exit (or written to the file as JSON, if the variable value ends with ".json").
+
+For each stage the wall time, number of calls, processed array sizes and (if :mod:`tracemalloc` is tracing)
+the peak allocated memory during the stage are recorded.
+The peak memory needs :func:`tracemalloc.reset_peak` (python>=3.9), otherwise it is None.
+The time and memory of the nested stages are included in the enclosing stage.
+The peak memory of the stages, running in parallel threads, is not separated.
+
+The instrumented stages:
+
+* "LLR.llr", "LLR.llr_window", "LLR.llr_binned" - the LLR evaluation (size: number of the events, or the (event, t0) pairs for "LLR.llr")
+* "LLR.sample" - the LLR sampling for the distributions (size: number of points)
+* "JointDistrBatch" - the distributions calculation (size: number of hypotheses), and its steps:
+  "JointDistr.integrals", "JointDistr.histograms", "JointDistr.norm", "JointDistr.fft", "JointDistr.combine"
+* "Sampler.sample", "Sampler.sample_many" - the events sampling (size: number of realisations)
+* "Analysis.l2z" - the significance conversion (size: number of values), including "Analysis.ztable" - the table construction
+* "rate.integral" - the integrals of the rates (size: number of intervals)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import contextlib
+import tracemalloc
+
+class Report:
+    """
+    The profiling results: statistics for each stage
+    """
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration, size=None, peak_memory=None):
+        """ record one call of the stage """
+        with self._lock:
+            s = self.stages.setdefault(name, {'calls':0, 'time':0., 'max_time':0., 'size':0, 'max_size':0, 'peak_memory':None})
+            s['calls'] += 1
+            s['time'] += duration
+            s['max_time'] = max(s['max_time'], duration)
+            if size is not None:
+                s['size'] += int(size)
+                s['max_size'] = max(s['max_size'], int(size))
+            if peak_memory is not None:
+                s['peak_memory'] = max(s['peak_memory'] or 0, peak_memory)
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: stage name -> dict with "calls", "time" (total, s), "max_time" (s),
+            "size" (total number of processed elements), "max_size" and "peak_memory" (bytes or None)
+        """
+        with self._lock:
+            return {name:dict(s) for name,s in self.stages.items()}
+
+    def to_json(self, fname=None):
+        """ the report as JSON string, or write it to the file `fname` """
+        s = json.dumps(self.to_dict(), indent=1)
+        if fname is None:
+            return s
+        with open(fname, 'w') as f:
+            f.write(s)
+
+    def __str__(self):
+        lines = [f"{'stage':32s} {'calls':>8s} {'time, ms':>10s} {'max, ms':>10s} {'size':>12s} {'peak, MB':>9s}"]
+        for name,s in sorted(self.to_dict().items(), key=lambda x:-x[1]['time']):
+            mem = '' if s['peak_memory'] is None else f"{s['peak_memory']/2**20:9.2f}"
+            lines += [f"{name:32s} {s['calls']:8d} {s['time']*1e3:10.3f} {s['max_time']*1e3:10.3f} {s['size']:12d} {mem:>9s}"]
+        return '\n'.join(lines)
+
+#the current report, or None, if profiling is disabled
+_report = None
+_null = contextlib.nullcontext()
+#the stack of the memory peaks of the active stages in each thread
+_local = threading.local()
+#python>=3.9
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+class _Stage:
+    __slots__ = ('report','name','size','t0','mem')
+    def __init__(self, report, name, size):
+        self.report = report
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        if _reset_peak is not None and tracemalloc.is_tracing():
+            stack = _local.__dict__.setdefault('stack', [])
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            _reset_peak()
+            self.mem = [current, current]
+            stack.append(self.mem)
+        else:
+            self.mem = None
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter()-self.t0
+        peak = None
+        if self.mem is not None and tracemalloc.is_tracing():
+            stack = _local.stack
+            start, stage_peak = stack.pop()
+            stage_peak = max(stage_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1][1] = max(stack[-1][1], stage_peak)
+            peak = stage_peak-start
+        self.report.add(self.name, duration, self.size, peak)
+        return False
+
+def stage(name, size=None):
+    """
+    Context manager, measuring the stage (if profiling is enabled)
+
+    Args:
+        name (str): stage name
+        size (int or None): number of the processed elements (i.e. array size)
+    """
+    if _report is None:
+        return _null
+    return _Stage(_report, name, size)
+
+def profiled(name, size=None):
+    """
+    Decorator, measuring the function calls as the stage (if profiling is enabled).
+    The overhead of the disabled profiling is smaller than with :func:`stage`
+
+    Args:
+        name (str): stage name
+        size (callable or None): function of the same arguments, returning the number of processed elements
+    """
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if _report is None:
+                return func(*args, **kwargs)
+            with _Stage(_report, name, None if size is None else size(*args, **kwargs)):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+def enabled():
+    """ check if the profiling is enabled """
+    return _report is not None
+
+def report():
+    """
+    Returns:
+        :class:`Report` or None: the current report, or None if profiling is disabled
+    """
+    return _report
+
+@contextlib.contextmanager
+def profile(memory=False):
+    """
+    Enable profiling inside the context
+
+    Args:
+        memory (bool): measure the peak memory of the stages (starts :mod:`tracemalloc`, which slows down the code).
+            Needs python>=3.9
+    Yields:
+        :class:`Report`: the report, filled during the context
+    """
+    global _report
+    prev, _report = _report, Report()
+    start_trace = memory and not tracemalloc.is_tracing()
+    if start_trace:
+        tracemalloc.start()
+    try:
+        yield _report
+    finally:
+        if start_trace:
+            tracemalloc.stop()
+        _report = prev
+
+def _report_at_exit(dest):
+    if dest.endswith('.json'):
+        _report.to_json(dest)
+    else:
+        print(_report, file=sys.stderr)
+
+if os.environ.get('SN_STAT_PROFILE', '') not in ('', '0'):
+    _report = Report()
+    atexit.register(_report_at_exit, os.environ['SN_STAT_PROFILE'])
@@ -1,18 +1,80 @@
 import numpy as np
-from scipy.integrate import quad
-from scipy.interpolate import interp1d,UnivariateSpline
+from ._lazy import LazyModule
+integrate = LazyModule('scipy.integrate')
+interpolate = LazyModule('scipy.interpolate')
 from abc import ABC, abstractmethod
+from .profiling import profiled
 
 class ABCRate(ABC):
     range = (-np.inf, np.inf)
     @abstractmethod
     def integral(self, t0:float ,t1:float) -> float:
+        """ Integral of the rate from `t0` to `t1`.
+        `t0` and `t1` can be the broadcastable arrays, then the array of integrals is returned
+        """
         return 0
 
     def total(self) -> float:
         return self.integral(*self.range)
+
+    def compile(self, range=None, *, npoints=10001, atol=None, max_points=10**7):
+        """ Tabulate the rate, to have fast vectorized evaluation and integral.
+
+        The rate is evaluated on the equidistant grid (with additional points around the edges of the ranges
+        and interpolation knots of the components), and linearly interpolated between the points.
+
+        Args:
+            range (None or tuple(float,float)):
+                the limits of the table. The compiled rate is 0 outside of this range.
+                If None, use `self.range` (it must be finite)
+
+        Keyword Args:
+            npoints (int): number of grid points
+            atol (float or None):
+                if given, double the number of points until the estimated error is below `atol`
+                (but not above `max_points`)
+            max_points (int): maximal number of grid points
+
+        Returns:
+            :class:`Tabulated`: compiled rate.
+            Its attribute `error` is the maximal difference between the rate and the table
+            in the middle points of the grid intervals. This is only an estimate of the accuracy:
+            it is good for the rates, smooth on the grid scale, but the features narrower than
+            the grid step can be missed completely.
+
+        Raises:
+            ValueError: if the range is infinite
+        """
+        if range is None:
+            range = self.range
+        if np.any(np.isinf(range)):
+            raise ValueError(f'Cannot tabulate the rate in infinite range: {range}')
+        t0,t1 = range
+        bp = _breakpoints(self)
+        bp = bp[(bp>t0)&(bp<t1)]
+        #add the points on both sides of each break point, to reproduce the steps
+        bp = np.concatenate([bp, np.nextafter(bp,-np.inf), np.nextafter(bp,np.inf)])
+        while True:
+            x = np.union1d(np.linspace(t0,t1,npoints), bp)
+            y = np.broadcast_to(self(x), x.shape)
+            #estimate the error in the middle of each interval
+            xm = 0.5*(x[1:]+x[:-1])
+            inner = (xm>x[:-1])&(xm<x[1:])
+            error = np.max(np.abs(self(xm)-0.5*(y[1:]+y[:-1]))[inner], initial=0)
+            if atol is None or error<=atol or 2*npoints>max_points:
+                return Tabulated(x, y, error=error)
+            npoints = 2*npoints-1
         
 
+#number of the intervals in the integral call, for profiling
+_nintervals = lambda self, t0, t1: np.size(t0)
+
+def _vectorize(func, t0, t1):
+    """ apply the scalar function `func(t0,t1)` to the broadcastable arrays `t0`, `t1` """
+    t0,t1 = np.broadcast_arrays(t0,t1)
+    res = np.array([func(a,b) for a,b in zip(t0.flat,t1.flat)], dtype=float)
+    return res.reshape(t0.shape)[()]
+
 class _limited(ABCRate):
     def __init__(self, r0, new_range):
         self._r0 = r0
@@ -20,9 +82,8 @@ class _limited(ABCRate):
     def __call__(self, t):
         return (self.range[0]<=t)*(t<=self.range[1])*self._r0(t)
     def integral(self, t0,t1):
-        R0,R1 = self.range
-        t0 = min(max(t0,R0),R1)
-        t1 = max(min(t1,R1),R0)
+        t0 = np.clip(t0,*self.range)
+        t1 = np.clip(t1,*self.range)
         return self._r0.integral(t0,t1)
 
 class _mul(ABCRate):
@@ -55,7 +116,7 @@ class _shift(ABCRate):
     def __call__(self, t):
         return self.r0(t-self.dt)
     def integral(self, t0,t1):
-        return self.r0.integral(t0-self.dt,t1-self.dt)
+        return self.r0.integral(np.subtract(t0,self.dt),np.subtract(t1,self.dt))
 
 class _invert(ABCRate):
     def __init__(self, r0):
@@ -64,7 +125,7 @@ class _invert(ABCRate):
     def __call__(self, t):
         return self.r0(-t)
     def integral(self, t0,t1):
-        return self.r0.integral(-t1,-t0)
+        return self.r0.integral(np.negative(t1),np.negative(t0))
 
 class Const(ABCRate):
     """Constant rate in time
@@ -76,11 +137,15 @@ class Const(ABCRate):
         self.c=c
     def __call__(self, t):
         return self.c*np.ones_like(t)
+    @profiled('rate.integral', _nintervals)
     def integral(self, t0,t1):
-        return self.c*(t1-t0)
+        return self.c*np.subtract(t1,t0)
 
 class Func(ABCRate):
     """Rate defined by the function
+
+    The integral is calculated with :func:`scipy.integrate.quad` for each pair of bounds separately.
+    For the fast vectorized integrals use the tabulated rate (see :meth:`ABCRate.compile`).
     
     Args:
         f(callable[float]->float): the desired rate vs. time function
@@ -89,8 +154,9 @@ class Func(ABCRate):
         self.f=f
     def __call__(self,t):
         return self.f(t)
+    @profiled('rate.integral', _nintervals)
     def integral(self, t0,t1):
-        return quad(self.f,t0,t1)[0]
+        return _vectorize(lambda a,b: integrate.quad(self.f,a,b)[0], t0, t1)
 
 class Interpolated(ABCRate):
     """Rate defined by linear interpolation of the given points
@@ -106,11 +172,15 @@ class Interpolated(ABCRate):
         kwargs.setdefault('ext',1)
         kwargs.setdefault('k',1)
         kwargs.setdefault('s',0)
-        self.f = UnivariateSpline(x,y,**kwargs)
+        self.f = interpolate.UnivariateSpline(x,y,**kwargs)
+        self.F = self.f.antiderivative()
     def __call__(self,t):
         return self.f(t)
+    @profiled('rate.integral', _nintervals)
     def integral(self, t0,t1):
-        return self.f.integral(t0,t1)
+        #the spline is zero outside of its range (as in `UnivariateSpline.integral`)
+        res = self.F(np.clip(t1,*self.range))-self.F(np.clip(t0,*self.range))
+        return res.reshape(np.broadcast(t0,t1).shape)[()]
 
     
 def _sort(x,y):
@@ -135,8 +205,7 @@ class LogRate(ABCRate):
         self.range=(min(x),max(x))
 
     def _index(self,x):
-        if np.isscalar(x):
-            x = [x]
+        x = np.atleast_1d(x)
         idx = np.searchsorted(self.x,x)-1
         if self.extrapolate:
             idx[idx<0]=0
@@ -157,10 +226,76 @@ class LogRate(ABCRate):
         x0,y0 = self.x[idx],self.y[idx]
         y1 = self._eval(idx)(x)
         res = self.yi[idx]+(y1*x-y0*x0)/(a+1)
-        return np.squeeze(res)
+        return res.reshape(np.shape(x))[()]
     
+    @profiled('rate.integral', _nintervals)
     def integral(self,x0,x1):
         return self._int(x1)-self._int(x0)
+
+class Tabulated(ABCRate):
+    """Rate defined by the table of values with linear interpolation between the points and zero outside of the table.
+
+    Both the rate values and integrals are vectorized: the integral is calculated exactly
+    (for the linear interpolation) from the table of cumulative integral values.
+    Usually constructed by :meth:`ABCRate.compile`.
+
+    Args:
+        x(1D array-like): time values (sorted)
+        y(1D array-like): rate values
+        error(float): estimated accuracy of the table (see :meth:`ABCRate.compile`)
+    """
+    def __init__(self, x, y, error=0):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.range = (self.x[0], self.x[-1])
+        self.error = error
+        self.ycum = np.append(0, np.cumsum(0.5*(self.y[1:]+self.y[:-1])*np.diff(self.x)))
+    def __call__(self, t):
+        return np.interp(t, self.x, self.y, left=0, right=0)
+    def _int(self, t):
+        t = np.clip(t, *self.range)
+        idx = np.clip(np.searchsorted(self.x, t, side='right')-1, 0, len(self.x)-2)
+        x0, y0 = self.x[idx], self.y[idx]
+        dt = t-x0
+        #fraction of the interval, bounded even for the tiny intervals
+        f = np.divide(dt, self.x[idx+1]-x0, out=np.zeros_like(dt*1.), where=dt>0)
+        return self.ycum[idx]+dt*(y0+0.5*(self.y[idx+1]-y0)*f)
+    @profiled('rate.integral', _nintervals)
+    def integral(self, t0, t1):
+        return self._int(t1)-self._int(t0)
+
+def _breakpoints(r):
+    """ find the points in which the rate can have discontinuities or kinks """
+    if isinstance(r, _limited):
+        return np.append(_breakpoints(r._r0), r.range)
+    if isinstance(r, _mul):
+        return _breakpoints(r._r0)
+    if isinstance(r, _sum):
+        return np.append(_breakpoints(r.r0), _breakpoints(r.r1))
+    if isinstance(r, _shift):
+        return _breakpoints(r.r0)+r.dt
+    if isinstance(r, _invert):
+        return -_breakpoints(r.r0)
+    if isinstance(r, (LogRate, Tabulated)):
+        return r.x
+    if isinstance(r, Interpolated):
+        return r.f.get_knots()
+    return np.empty(0)
+
+def _constant(r):
+    """ the value of the rate, if it is constant in time, otherwise None """
+    if isinstance(r, Const):
+        return r.c
+    if isinstance(r, _mul):
+        c = _constant(r._r0)
+        return None if c is None else r.C*c
+    if isinstance(r, _sum):
+        c0,c1 = _constant(r.r0), _constant(r.r1)
+        return None if c0 is None or c1 is None else c0+c1
+    if isinstance(r, (_shift, _invert)):
+        return _constant(r.r0)
+    return None
+
 ABCRate.__add__ = lambda self, other: _sum(self,other)
 ABCRate.__mul__ = lambda self, factor:_mul(self,factor)
 ABCRate.__rmul__= lambda self, factor:_mul(self,factor)
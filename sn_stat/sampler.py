@@ -1,41 +1,68 @@
 import numpy as np
-from scipy.integrate import cumtrapz
-from scipy.interpolate import interp1d
+from .profiling import profiled
 
 class Sampler:
     """ Generates random event samples (timestamps) following the given event rate"""
-    def __init__(self,r, time_window=[0,10], Npoints=1000):
+    def __init__(self,r, time_window=[0,10], Npoints=1000, rng=None):
         """
         Args:
             r (rate): event rate
             time_window (tuple[float,float]): limits in which the events are generated
             Npoints (int): number of subdivisions for the integration.
-                The initial distribution is approximated by `Npoints` 
+                The initial distribution is approximated by `Npoints`
                 equidistant points in the `time_window` range
+            rng (None, int, :class:`numpy.random.SeedSequence` or :class:`numpy.random.Generator`):
+                random number generator or its seed (see :func:`numpy.random.default_rng`)
         """
         x = np.linspace(*time_window,Npoints)
         y = r(x)
+        self.rng = np.random.default_rng(rng)
         self._set(x,y)
-    
+
     def _set(self,x,y):
         order = np.argsort(x)
         self.x=x[order]
-        self.y=y[order]
-        ycum = cumtrapz(y=self.y,x=self.x, initial=0)
+        self.y=np.broadcast_to(y,x.shape)[order]
+        ycum = np.cumsum(0.5*(self.y[1:]+self.y[:-1])*np.diff(self.x))
+        ycum = np.concatenate([[0],ycum])
         self.ycum=ycum
         Ytotal = ycum[-1]
-        #print(Ytotal)
-        p= ycum/Ytotal
-        self.x_of_p = interp1d(p,self.x)
+        #inverse CDF table
+        self.p = ycum/Ytotal
         self.Ytotal = Ytotal
-        
+
+    def x_of_p(self, ps):
+        """ inverse cumulative distribution function: linear interpolation of the table"""
+        return np.interp(ps, self.p, self.x)
+
+    @profiled('Sampler.sample')
     def sample(self):
         """ Produce the random events
 
         Returns:
             ndarray: 1-d array with the events timestamps
         """
-        Ntot = np.random.poisson(self.Ytotal)
-        ps = np.random.rand(Ntot)
+        Ntot = self.rng.poisson(self.Ytotal)
+        ps = self.rng.random(Ntot)
         return self.x_of_p(ps)
-    
+
+    @profiled('Sampler.sample_many', size=lambda self, N, *args, **kwargs: N)
+    def sample_many(self, N, dtype=np.float64):
+        """ Produce `N` independent realisations of the events
+
+        Args:
+            N (int): number of realisations
+            dtype (numpy dtype): type of the output timestamps (i.e. `np.float32` to save memory)
+
+        Returns:
+            tuple(ndarray, ndarray): flat array of the timestamps of all realisations
+            and array of `N+1` offsets: the events of realisation `i` are `ts[offsets[i]:offsets[i+1]]`
+        """
+        Ns = self.rng.poisson(self.Ytotal, size=N)
+        offsets = np.concatenate([[0],np.cumsum(Ns)])
+        ps = self.rng.random(offsets[-1])
+        return self.x_of_p(ps).astype(dtype, copy=False), offsets
+
+def split(ts, offsets):
+    """ split the flat array of timestamps, produced by :meth:`Sampler.sample_many`, to the list of realisations """
+    return np.split(ts, offsets[1:-1])
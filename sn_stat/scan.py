@@ -0,0 +1,83 @@
+import numpy as np
+from .sig_calc import CountingAnalysis
+from .llr import window_bounds
+
+def open_events(fname, dtype=np.float64):
+    """
+    Open the file with the sorted events timestamps without reading it into memory.
+
+    Args:
+        fname (str): `.npy` file, or the raw binary file with the array of `dtype` values
+        dtype (numpy dtype): type of the values in the raw file
+
+    Returns:
+        :class:`numpy.memmap` or ndarray: read-only memory mapped array of the timestamps
+    """
+    if str(fname).endswith('.npy'):
+        return np.load(fname, mmap_mode='r')
+    return np.memmap(fname, dtype=dtype, mode='r')
+
+def scan_file(analysis, data, t0, output=None, chunk_duration=None, **params):
+    """
+    Calculate the significance for the `t0` grid, reading the events in chunks.
+
+    The `t0` grid is split to the chunks of `chunk_duration`, and for each chunk only the events
+    inside its time windows are read from the (memory mapped) files, so the memory usage
+    doesn't depend on the length of the files.
+    The events of neighbouring chunks overlap by the time window, and the result
+    is identical to the calculation for the whole data in memory
+    (with `method="window"` for :class:`ShapeAnalysis`, which is the default here).
+
+    Args:
+        analysis (:class:`ShapeAnalysis` or :class:`CountingAnalysis`): the analysis to use
+        data (str, ndarray or list of them):
+            sorted events timestamps for each detector: file names (see :func:`open_events`) or arrays.
+            If there is only one detector, just a single item is enough
+        t0 (ndarray of float): sorted assumed signal start times
+        output (str, ndarray or None): the array or `.npy` file name to write the significance.
+            If None - a new array is created
+        chunk_duration (float or None): the time range of `t0` values in each chunk.
+            If None - 100 widths of the analysis time window
+
+    Keyword Args:
+        params (dict of kwargs): parameters to pass to the analysis
+
+    Returns:
+        ndarray or :class:`numpy.memmap`: significance values for each `t0`
+    Raises:
+        ValueError: if the `t0` or the events are not sorted
+    """
+    if isinstance(analysis, CountingAnalysis):
+        dets = [analysis.det]
+    else:
+        dets = analysis.det
+        params.setdefault('method','window')
+    if isinstance(data, (str, np.ndarray)) or len(data)!=len(dets):
+        data = [data]
+    data = [open_events(d) if isinstance(d, str) else d for d in data]
+    t0 = np.asarray(t0, dtype=float)
+    if np.any(np.diff(t0)<0):
+        raise ValueError('t0 values should be sorted')
+    if isinstance(output, str):
+        output = np.lib.format.open_memmap(output, mode='w+', dtype=np.float64, shape=t0.shape)
+    elif output is None:
+        output = np.empty(t0.shape)
+    if chunk_duration is None:
+        chunk_duration = 100*np.ptp(analysis.time_window)
+    starts = np.searchsorted(t0, np.arange(t0[0], t0[-1], chunk_duration), side='left') if t0.size else []
+    edges = np.append(np.unique(starts), len(t0)).astype(int)
+    for i0,i1 in zip(edges[:-1], edges[1:]):
+        chunk = []
+        for d,det in zip(data, dets):
+            #the range of events, needed for the first and the last t0 in the chunk
+            lo = window_bounds(d, t0[i0:i0+1], det.time_window)[0][0]
+            hi = window_bounds(d, t0[i1-1:i1], det.time_window)[1][0]
+            ts = np.array(d[lo:hi], dtype=float)
+            if np.any(np.diff(ts)<0):
+                raise ValueError('Events timestamps should be sorted')
+            chunk += [ts]
+        z = analysis(chunk[0] if isinstance(analysis, CountingAnalysis) else chunk, t0[i0:i1], **params)
+        output[i0:i1] = z
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output
@@ -1,10 +1,12 @@
-from scipy import stats
 import numpy as np
-from .llr import JointDistr, LLR
+from .llr import JointDistr, JointDistrBatch, LLR, Distr
 from . import DetConfig
+from ._lazy import LazyModule
 from abc import ABC, abstractmethod
-from scipy.stats import poisson
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from .profiling import stage, profiled
+stats = LazyModule('scipy.stats')
 
 def p2z(p):
     "convert p-value to significance"
@@ -14,13 +16,111 @@ def z2p(z):
     return stats.norm.sf(z)
 
 
+def scan_llrs(llrs, data, t0, **params):
+    """ calculate the LLR values for each detector
+
+    Returns:
+        ndarray: LLR values with shape `(len(llrs), len(t0))`
+    """
+    return np.stack([l(d,t0,**params) for l,d in zip(llrs, data)]).reshape(len(llrs),len(t0))
+
+class StepZTable:
+    """
+    Exact significance table for the step-function p-value (:class:`sn_stat.llr.Distr`):
+    the p-value is constant between the bin edges and centers, so the significance
+    is precomputed for each interval and found with :func:`numpy.searchsorted`.
+
+    Args:
+        l2z (callable): exact conversion function
+        x (ndarray): sorted points, where the p-value can change
+    """
+    z_precision = 0
+    def __init__(self, l2z, x):
+        self.x = x
+        #the value above the last point is taken right after it
+        self.z = l2z(np.append(x, np.nextafter(x[-1],np.inf)))
+    def __call__(self, l):
+        return self.z[np.searchsorted(self.x, l, side='left')]
+
+class IntZTable:
+    """
+    Exact significance table for the integer test statistics (number of events)
+    from 0 to `kmax`. Other values are converted with the exact function.
+
+    Args:
+        l2z (callable): exact conversion function
+        kmax (int): maximal value in the table
+    """
+    z_precision = 0
+    def __init__(self, l2z, kmax):
+        self.l2z = l2z
+        self.z = l2z(np.arange(kmax+1))
+    def __call__(self, l):
+        l = np.asarray(l)
+        idx = np.clip(np.nan_to_num(l), 0, len(self.z)-1).astype(int)
+        in_table = (idx==l)
+        if np.all(in_table):
+            return self.z[idx]
+        return np.where(in_table, self.z[idx], self.l2z(l))
+
+class InterpZTable:
+    """
+    Significance table with linear interpolation on the grid of the test statistic values.
+    The grid is refined until the interpolation error (estimated in the middle points)
+    is below `z_precision`. Outside of the grid the exact function is used.
+
+    Args:
+        l2z (callable): exact conversion function
+        l_range (tuple(float,float)): the range of the grid. It is narrowed down
+            to the part, where the significance is in `z_range`
+        z_range (tuple(float,float)): the range of the significance values in the table
+        z_precision (float): the required precision
+        npoints (int): initial number of grid points
+        max_points (int): maximal number of grid points
+    """
+    def __init__(self, l2z, l_range, z_range=(-3,np.inf), z_precision=1e-6, npoints=1025, max_points=2**20):
+        self.l2z = l2z
+        #the significance is steep (and can be undefined) for the p-values close to 1
+        x = np.linspace(*l_range, npoints)
+        z = l2z(x)
+        inside = np.flatnonzero((z>=z_range[0])&(z<=z_range[1]))
+        if len(inside)<2:
+            inside = np.array([0,npoints-1])
+        l_range = x[inside[0]], x[inside[-1]]
+        while True:
+            x = np.linspace(*l_range, npoints)
+            z = l2z(x)
+            xm = 0.5*(x[1:]+x[:-1])
+            err = np.abs(l2z(xm)-0.5*(z[1:]+z[:-1]))
+            self.z_precision = np.nanmax(err, initial=0)
+            if self.z_precision<=z_precision or 2*npoints>max_points:
+                break
+            npoints = 2*npoints-1
+        self.x, self.z = x, z
+    def __call__(self, l):
+        l = np.asarray(l)
+        z = np.interp(l, self.x, self.z)
+        exact = (l<self.x[0])|(l>self.x[-1])|~np.isfinite(z)
+        if np.any(exact):
+            z = np.where(exact, self.l2z(l), z)
+        return z[()]
+
 class Analysis(ABC):
     def __init__(self, discrete=False):
-        self.d0 = self.l_distr(hypos="H0")
-        if discrete:
-            self._pmf = self.d0.pmf
-        else:
-            self._pmf = self.d0.pdf#lambda x:0
+        self.discrete = discrete
+        self._d0 = None
+        self._ztable = None
+
+    @property
+    def d0(self):
+        "the test statistic distribution for the background only hypothesis (calculated on the first use)"
+        if self._d0 is None:
+            self.d0 = self.l_distr(hypos="H0")
+        return self._d0
+    @d0.setter
+    def d0(self, d):
+        self._d0 = d
+        self._ztable = None
 
     @abstractmethod
     def l_distr(self, hypos, add_bg=False):
@@ -66,25 +166,69 @@ class Analysis(ABC):
  
     def l2p(self, l):
         "convert TestStatistics to p-value"
-        return self.d0.sf(l)+self._pmf(l)
+        if self.discrete:
+            return self.d0.sf(l)+self.d0.pmf(l)
+        if isinstance(self.d0, Distr):
+            return self.d0.sf(l)+self.d0.pdf(l)
+        #continuous distribution: no probability at the point
+        return self.d0.sf(l)
     def p2l(self, p):
         "convert p-value to TestStatistics"
         return self.d0.isf(p)
+    @profiled('Analysis.l2z', size=lambda self, l: np.size(l))
     def l2z(self, l):
-        "convert TestStatistics to significance"
+        "convert TestStatistics to significance (using the table, see :meth:`ztable`)"
+        return self.ztable()(l)
+    def l2z_exact(self, l):
+        "convert TestStatistics to significance, calculating the p-value"
         return p2z(self.l2p(l))
+    def ztable(self):
+        """
+        Get the precomputed lookup table for :meth:`l2z` (it is constructed on the first call).
+        Its attribute `z_precision` is the maximal deviation from :meth:`l2z_exact`.
+        """
+        if self._ztable is None:
+            with stage('Analysis.ztable'):
+                self._ztable = self.make_ztable()
+        return self._ztable
+    def make_ztable(self):
+        if isinstance(self.d0, Distr):
+            x = np.union1d(self.d0.bins, 0.5*(self.d0.bins[1:]+self.d0.bins[:-1]))
+            return StepZTable(self.l2z_exact, x)
+        #continuous distribution: interpolate in the range -3...8 sigma
+        l_range = self.d0.isf([1-1e-15, 1e-15])
+        return InterpZTable(self.l2z_exact, l_range, z_range=(-3, np.inf))
     def z2l(self, z):
         "convert significance to TestStatistics"
         return self.d0.isf(z2p(z))
 
-    def z_quant(self,hypos,add_bg=False,qs=z2p([-1,0,1])):
+    def z_quant(self,hypos,add_bg=False,qs=None):
         """
         calculate zs, corresponding to quantiles of given hypotheses
+        (by default `qs=z2p([-1,0,1])`: the median and +-1 sigma)
         """
+        if qs is None:
+            qs = z2p([-1,0,1])
         d1 = self.l_distr(hypos,add_bg)
         ls = d1.isf(qs)
         zs = self.l2z(ls)
         return np.nan_to_num(zs)
+    def l_distr_batch(self, hypos_list, add_bg=False, workers=None):
+        """
+        calculate test statistic distributions for each of the hypotheses in `hypos_list` (see :meth:`l_distr`)
+        """
+        return [self.l_distr(h, add_bg) for h in hypos_list]
+    def z_quant_batch(self, hypos_list, add_bg=False, qs=None, workers=None):
+        """
+        calculate :meth:`z_quant` for each of the hypotheses in `hypos_list` (i.e. for the sensitivity curves)
+
+        Returns:
+            ndarray: zs with shape `(len(hypos_list), len(qs))`
+        """
+        if qs is None:
+            qs = z2p([-1,0,1])
+        ds = self.l_distr_batch(hypos_list, add_bg, workers=workers)
+        return np.array([np.nan_to_num(self.l2z(d.isf(qs))) for d in ds])
     def z_distr(self,hypos, add_bg=False,zbins=100):
         """
         calculate significance distribution based on given hypotheses `hypos`
@@ -120,18 +264,51 @@ class CountingAnalysis(Analysis):
             hypos = hypos+self.det.B
 
         N = hypos.integral(*self.det.time_window)
-        return poisson(mu=N)
+        return stats.poisson(mu=N)
+
+    def make_ztable(self):
+        #table up to ~8 sigma, the larger values are calculated exactly
+        return IntZTable(self.l2z_exact, kmax=int(self.d0.isf(1e-15)))
 
     def l_val(self, data, t0, **params):
-        data = np.array(data, ndmin=2).T
-        t0 = np.array(t0, ndmin=2)
+        return self.l_val_batch([data], t0)[0]
+
+    def l_val_batch(self, datasets, t0):
+        """
+        Calculate the number of events in the time window for many datasets (i.e. Monte-Carlo trials)
+
+        Each dataset is sorted, and the numbers of events are the differences of
+        :func:`numpy.searchsorted` positions of the window edges, so no `(N_events, N_t0)` matrix is created.
+
+        Args:
+            datasets (iterable of array of float):
+                arrays of the events time stamps (can have different lengths)
+            t0 (ndarray of float):
+                assumed time/times of signal start
+        Returns:
+            ndarray of int: the number of events with shape `(len(datasets), len(t0))`
+        """
+        t0 = np.array(t0, ndmin=1)
         tw = self.det.time_window
         T0,T1 = tw[0]+t0, tw[1]+t0
-        return np.sum( (data>=T0)&(data<=T1), axis=0)
+        res = np.empty((len(datasets),len(t0)), dtype=int)
+        for i,data in enumerate(datasets):
+            data = np.sort(np.ravel(data))
+            res[i] = np.searchsorted(data,T1,side='right')-np.searchsorted(data,T0,side='left')
+        return res
+
+    def z_batch(self, datasets, t0):
+        """
+        Calculate significance for many datasets (see :meth:`l_val_batch`)
+
+        Returns:
+            ndarray of float: significance values with shape `(len(datasets), len(t0))`
+        """
+        return self.l2z(self.l_val_batch(datasets, t0))
 
 
 class ShapeAnalysis(Analysis):
-    def __init__(self, detectors, **params):
+    def __init__(self, detectors, cache=None, **params):
         """ 
         Calculating significance using the shape analysis method, 
         using Log Likelihood Ratio (:class:`LLR`) 
@@ -141,6 +318,9 @@ class ShapeAnalysis(Analysis):
                 configurations for each experiment. 
                 Passing single DetConfig :code:`ShapeAnalysis(det)` is equivalent 
                 to passing a list with one item :code:`ShapeAnalysis([det])`
+            cache (None or str or :class:`sn_stat.cache.DistrCache`):
+                if given, the LLR distributions are loaded from this persistent cache
+                (or cache directory), instead of being calculated every time
                     
         Keyword Args:
             params (dict of kwargs):
@@ -155,22 +335,174 @@ class ShapeAnalysis(Analysis):
                 ]
         self.llrs = [LLR(d) for d in detectors]
         self.params=params
+        if isinstance(cache, str):
+            from .cache import DistrCache
+            cache = DistrCache(cache)
+        self.cache = cache
         self.det = detectors
         super().__init__()
     
-    def l_val(self, data, t0, **params):
+    def l_val(self, data, t0, workers=1, shard='both', **params):
+        """
+        Calculate the sum of LLR values of all the detectors
+
+        Args:
+            data (iterable of array of float): 
+                List with arrays of measured events time stamps for each detector.
+                If there is only one detector, just an array(float) is enough
+            t0 (ndarray of float):
+                assumed time/times of signal start
+            workers (int or None):
+                number of processes for the calculation. If 1 - calculate in this process,
+                if None - use all CPUs (see :func:`sn_stat.parallel.parallel_scan`)
+            shard ("t0", "det" or "both"):
+                split the parallel calculation by `t0` chunks, by detectors, or both
+            params:
+                additional parameters for :meth:`LLR.__call__`
+        Returns:
+            ndarray of float:
+                test statistic values for each value in `t0`
+        """
         if(len(data)!=len(self.llrs)):
             data = np.array(data, ndmin=2)
             assert data.shape[0]==len(self.llrs)
-        ls = np.stack([l(d,t0,**params) for l,d in zip(self.llrs, data)])
+        t0 = np.array(t0, ndmin=1)
+        if workers==1:
+            ls = scan_llrs(self.llrs, data, t0, **params)
+        else:
+            from .parallel import parallel_scan
+            ls = parallel_scan(self.llrs, data, t0, workers=workers, shard=shard, **params)
         return np.sum(ls,axis=0)
    
-    def l_distr(self,hypos,add_bg=False):
+    def _hypos(self, hypos, add_bg):
         if hypos!="H0":
             if not isinstance(hypos, Iterable):
                 hypos=[hypos]
             assert len(hypos)==len(self.llrs)
             if(add_bg):
                 hypos = [h+l.det.B for h,l in zip(hypos,self.llrs)]
+        return hypos
+
+    def l_distr(self,hypos,add_bg=False):
+        hypos = self._hypos(hypos, add_bg)
+        if self.cache is not None:
+            return self.cache.joint_distr(self.llrs,hypos,**self.params)
         return JointDistr(self.llrs,hypos,**self.params)
+
+    def l_distr_batch(self, hypos_list, add_bg=False, workers=None):
+        """
+        calculate the LLR distributions for each of the hypotheses in `hypos_list`,
+        sharing the LLR samples and using `workers` threads (see :func:`sn_stat.llr.JointDistrBatch`)
+        """
+        hypos_list = [self._hypos(h, add_bg) for h in hypos_list]
+        if self.cache is not None:
+            return self.cache.joint_distr_batch(self.llrs,hypos_list,workers=workers,**self.params)
+        return JointDistrBatch(self.llrs,hypos_list,workers=workers,**self.params)
     
+
+
+class TimeVaryingShapeAnalysis(ShapeAnalysis):
+    def __init__(self, detectors, t0_range, cache=None, *, npoints=11, rtol=1e-2, max_points=1000, workers=None, **params):
+        """
+        Shape analysis with the null hypothesis distribution, depending on `t0`:
+        for the time-varying background rates (i.e. the detector livetime or seasonal changes).
+
+        The null distributions are calculated (in the thread pool, optionally using the persistent cache)
+        on the grid of `t0` values. The grid starts from `npoints` equidistant points in `t0_range`,
+        and each interval is bisected, while the relative change of the background integral
+        in the time window of any detector is above `rtol`.
+        The significance for `t0` between the grid points is linearly interpolated
+        between the significances (i.e. the p-values in the gaussian scale) of the neighbour points.
+        Outside of `t0_range` the distributions of the edge points are used.
+
+        Args:
+            detectors (single :class:`DetConfig` or iterable of :class:`DetConfig`):
+                configurations for each experiment
+            t0_range (tuple(float,float)): the range of `t0` for the grid
+            cache (None or str or :class:`sn_stat.cache.DistrCache`):
+                the cache for the LLR distributions (see :class:`ShapeAnalysis`)
+
+        Keyword Args:
+            npoints (int): initial number of grid points
+            rtol (float): maximal relative change of the background integral between the grid points
+            max_points (int): maximal number of grid points
+            workers (int or None): number of threads for the distributions calculation
+            params (dict of kwargs):
+                configuration arguments to be passed to :func:`sn_stat.llr.JointDistr`
+        """
+        super().__init__(detectors, cache=cache, **params)
+        self.t0_range = t0_range
+        self.npoints = npoints
+        self.rtol = rtol
+        self.max_points = max_points
+        self.workers = workers
+        self._grid = None
+
+    def _bg_integrals(self, t0):
+        return np.array([[l.det.B.integral(*l.det.time_window+t) for l in self.llrs] for t in t0])
+
+    def make_grid(self):
+        """
+        Construct the grid of `t0` values, refined where the background changes quickly
+
+        Returns:
+            ndarray: sorted `t0` values
+        """
+        t0 = np.linspace(*self.t0_range, self.npoints)
+        R = self._bg_integrals(t0)
+        while len(t0)<self.max_points:
+            change = np.max(np.abs(np.diff(R, axis=0))/np.maximum(np.maximum(R[1:],R[:-1]), 1e-300), axis=1)
+            split = np.flatnonzero(change>self.rtol)[:self.max_points-len(t0)]
+            if len(split)==0:
+                break
+            tm = 0.5*(t0[split]+t0[split+1])
+            t0 = np.insert(t0, split+1, tm)
+            R = np.insert(R, split+1, self._bg_integrals(tm), axis=0)
+        return t0
+
+    def grid(self):
+        """
+        Get the `t0` grid and the analyses with the null distributions for each point (calculated on the first call)
+
+        Returns:
+            tuple(ndarray, list of :class:`ShapeAnalysis`)
+        """
+        if self._grid is None:
+            t0 = self.make_grid()
+            def _make(t):
+                ana = ShapeAnalysis(self.det, cache=self.cache, **dict(self.params, t0=t))
+                ana.ztable()
+                return ana
+            with ThreadPoolExecutor(self.workers) as pool:
+                self._grid = (t0, list(pool.map(_make, t0)))
+        return self._grid
+
+    def l2z(self, l, t0=None):
+        "convert TestStatistics to significance for the signal start times `t0` (by default - the `t0` parameter or 0)"
+        if t0 is None:
+            t0 = self.params.get('t0', 0)
+        ts, anas = self.grid()
+        l, t0 = np.broadcast_arrays(np.asarray(l, dtype=float), np.asarray(t0, dtype=float))
+        if len(ts)==1:
+            return anas[0].l2z(l)
+        i = np.clip(np.searchsorted(ts, t0, side='right')-1, 0, len(ts)-2)
+        w = np.clip((t0-ts[i])/(ts[i+1]-ts[i]), 0, 1)
+        z = np.empty(l.shape)
+        for k in np.unique(i):
+            sel = i==k
+            z0, z1, wk = anas[k].l2z(l[sel]), anas[k+1].l2z(l[sel]), w[sel]
+            #the infinite significance is kept on the grid points
+            with np.errstate(invalid='ignore'):
+                z[sel] = np.where(wk==0, z0, np.where(wk==1, z1, (1-wk)*z0+wk*z1))
+        return z[()]
+
+    def l2p(self, l, t0=None):
+        "convert TestStatistics to p-value for the signal start times `t0`"
+        return z2p(self.l2z(l, t0))
+
+    def __call__(self, data, t0, **params):
+        """
+        calculate significance for the set of measurements
+        """
+        t0 = np.array(t0, ndmin=1)
+        return self.l2z(self.l_val(data, t0, **params), t0)
@@ -1,3 +1,5 @@
+import os
+import json
 import numpy as np
 from .rate import rate
 
@@ -25,7 +27,93 @@ def preSN(S0=1,t_rise=100,t_decay=0.1):
     f = ccSN(S0,t_rise=t_decay,t_decay=t_rise)
     return Signal(lambda t:f(t_decay-t), distance=1)
 
-def from_file(fname, dt=5e-3, distance=10, scale=1):
-    s = np.loadtxt(fname)*scale/dt
+def _make_signal(vals, dt, distance, scale):
+    s = np.ravel(vals)*scale/dt
     t = np.arange(len(s))*dt
-    return Signal((t,s), distance=distance)
\ No newline at end of file
+    return Signal((t,s), distance=distance)
+
+def from_file(fname, dt=5e-3, distance=10, scale=1):
+    """ read the signal model from the text file with the number of events in each time bin of `dt`
+    (see also :class:`ModelArchive` for the fast loading of many models) """
+    return _make_signal(np.loadtxt(fname), dt, distance, scale)
+
+_ARCHIVE_MAGIC = b'SNSTATM1'
+
+def build_archive(models, fname):
+    """
+    Convert the text signal model files (see :func:`from_file`) into a single binary archive,
+    which can be opened with :class:`ModelArchive`.
+
+    The archive contains the header with the JSON index (model name -> offset and length)
+    and the float64 values of all the models.
+
+    Args:
+        models (str or list of str): directory with the model files (all the files in it), or list of the files.
+            The model names are the file names without the extension
+        fname (str): output archive file name
+    """
+    if isinstance(models, str):
+        models = sorted(os.path.join(models,f) for f in os.listdir(models)
+                        if os.path.isfile(os.path.join(models,f)))
+    index, data, offset = {}, [], 0
+    for f in models:
+        name = os.path.splitext(os.path.basename(f))[0]
+        vals = np.ravel(np.loadtxt(f)).astype(np.float64)
+        index[name] = [offset, len(vals)]
+        data += [vals]
+        offset += len(vals)
+    header = json.dumps(index).encode()
+    #data starts at 8 bytes aligned position
+    header += b' '*(-(len(header)+16)%8)
+    tmpname = f'{fname}.tmp'
+    with open(tmpname,'wb') as f:
+        f.write(_ARCHIVE_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for vals in data:
+            f.write(vals.tobytes())
+    os.replace(tmpname, fname)
+
+class ModelArchive:
+    """
+    Signal models from the binary archive, created by :func:`build_archive`.
+
+    Only the index is read on opening, the model values are read lazily through :class:`numpy.memmap`,
+    and the :class:`Signal` objects are cached.
+
+    Args:
+        fname (str): archive file name
+    """
+    def __init__(self, fname):
+        with open(fname,'rb') as f:
+            if f.read(len(_ARCHIVE_MAGIC))!=_ARCHIVE_MAGIC:
+                raise ValueError(f'{fname} is not a signal models archive')
+            size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.index = json.loads(f.read(size))
+        self.fname = fname
+        self._offset = len(_ARCHIVE_MAGIC)+8+size
+        self._data = None
+        self._signals = {}
+
+    def __len__(self):
+        return len(self.index)
+    def __contains__(self, name):
+        return name in self.index
+    def __iter__(self):
+        return iter(self.index)
+    def names(self):
+        return list(self.index)
+
+    def values(self, name):
+        """ the model values (number of events in each time bin) as read-only array"""
+        if self._data is None:
+            self._data = np.memmap(self.fname, dtype=np.float64, mode='r', offset=self._offset)
+        offset, length = self.index[name]
+        return self._data[offset:offset+length]
+
+    def signal(self, name, dt=5e-3, distance=10, scale=1):
+        """ the :class:`Signal` for the model, same as :func:`from_file` for the original file """
+        key = (name, dt, distance, scale)
+        if key not in self._signals:
+            self._signals[key] = _make_signal(np.array(self.values(name)), dt, distance, scale)
+        return self._signals[key]
\ No newline at end of file
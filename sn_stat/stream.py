@@ -0,0 +1,104 @@
+import numpy as np
+from .sig_calc import ShapeAnalysis
+
+class ShapeStream:
+    """
+    Incremental shape analysis for the live stream of events.
+
+    The assumed signal start times `t0` form a regular grid with step `dt`.
+    For each detector the events from the last `time_window` are kept in a buffer.
+    On each :meth:`push` only the grid points, affected by the new events, are updated,
+    and the grid points, which can not receive any more events, are converted
+    to significance with :meth:`ShapeAnalysis.l2z` and returned.
+
+    Args:
+        analysis (:class:`ShapeAnalysis` or iterable of :class:`DetConfig`):
+            analysis to use. If detector configurations are given, :class:`ShapeAnalysis` is constructed
+        dt (float): step of the `t0` grid
+        t_start (float): reference point of the `t0` grid.
+            The grid points, which windows end before the first pushed data, are skipped.
+
+    Keyword Args:
+        params (dict of kwargs):
+            parameters to pass to :meth:`LLR.__call__`. Default is `method="window"`
+    """
+    def __init__(self, analysis, dt, t_start=0, **params):
+        if not isinstance(analysis, ShapeAnalysis):
+            analysis = ShapeAnalysis(analysis)
+        self.ana = analysis
+        self.dt = dt
+        self.t_start = t_start
+        params.setdefault('method','window')
+        self.params = params
+        self.windows = np.array([l.det.time_window for l in self.ana.llrs])
+        #open grid points and their accumulated LLR values
+        self.k_next = 0
+        self.t0 = np.empty(0)
+        self.ls = np.empty(0)
+        self.buffers = [np.empty(0) for l in self.ana.llrs]
+        self.now = -np.inf
+
+    def _grid(self, k0, k1):
+        return self.t_start+np.arange(k0,k1)*self.dt
+
+    def push(self, data, now=None):
+        """
+        Add new events to the stream.
+
+        Args:
+            data (iterable of array of float):
+                new events timestamps for each detector (can be empty).
+                If there is only one detector, just an array(float) is enough
+            now (float or None):
+                time, up to which all the events have been already pushed.
+                If None - use the latest timestamp seen so far
+        Returns:
+            tuple(ndarray,ndarray): the `t0` grid points, which are completed by this data, and their significance values
+        Raises:
+            ValueError: if events are older than the time, already processed by previous calls
+        """
+        if len(self.buffers)==1 and (len(data)==0 or np.ndim(data[0])==0):
+            data = [data]
+        if(len(data)!=len(self.buffers)):
+            raise ValueError(f'Expected data for {len(self.buffers)} detectors, got {len(data)}')
+        data = [np.sort(np.array(d, dtype=float, ndmin=1)) for d in data]
+        t_max = max([d[-1] for d in data if d.size], default=-np.inf)
+        if any(d.size and d[0]<self.now for d in data):
+            raise ValueError(f'Events should not be older than already processed time {self.now}')
+        if not np.isfinite(self.now):
+            #start the grid at the first data
+            t_first = min([d[0] for d in data if d.size], default=t_max if now is None else now)
+            if np.isfinite(t_first):
+                k0 = np.ceil((t_first-self.windows[:,1].max()-self.t_start)/self.dt)
+                self.k_next = max(self.k_next, int(k0))
+        self.now = max(self.now, t_max if now is None else now)
+        if not np.isfinite(self.now):
+            return np.empty(0), np.empty(0)
+
+        #update the LLR for already open points
+        for l,d in zip(self.ana.llrs, data):
+            if d.size and self.t0.size:
+                self.ls += l(d, self.t0, **self.params)
+        self.buffers = [np.concatenate([b,d]) for b,d in zip(self.buffers,data)]
+
+        #open new points, which windows have already started
+        k1 = int(np.floor((self.now-self.windows[:,0].min()-self.t_start)/self.dt))+1
+        if k1>self.k_next:
+            t0 = self._grid(self.k_next, k1)
+            ls = np.zeros(t0.shape)
+            for l,b in zip(self.ana.llrs, self.buffers):
+                ls += l(b, t0, **self.params)
+            self.t0 = np.concatenate([self.t0, t0])
+            self.ls = np.concatenate([self.ls, ls])
+            self.k_next = k1
+
+        #close the points, which windows have passed
+        n = np.searchsorted(self.t0+self.windows[:,1].max(), self.now, side='left')
+        t0, ls = self.t0[:n], self.ls[:n]
+        self.t0, self.ls = self.t0[n:], self.ls[n:]
+
+        #drop the events, which can not be in any of the future windows
+        t_first = self.t0[0] if self.t0.size else self._grid(self.k_next,self.k_next+1)[0]
+        self.buffers = [b[np.searchsorted(b, t_first+tw[0]-self.dt):]
+                        for b,tw in zip(self.buffers, self.windows)]
+        return t0, self.ana.l2z(ls)
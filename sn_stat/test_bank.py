@@ -0,0 +1,19 @@
+import numpy as np
+import sn_stat as sn
+from sn_stat.bank import TemplateBank
+from sn_stat.signals import ccSN
+
+def test_template_bank(tmp_path):
+    B = [sn.rate(10), sn.rate(20)]
+    templates = [[sn.DetConfig(B=b, S=ccSN(S0=100, t_rise=tr, t_decay=td).at(10), time_window=[0,tw]) for b in B]
+                 for tr in [0.05,0.2] for td,tw in [(1,10),(2,15)]]
+    templates += [[sn.DetConfig(B=sn.rate(10), S=sn.rate(([0,1,10],[0,2,0]))) for b in B]]
+    bank = TemplateBank(templates, cache=str(tmp_path), workers=2)
+    assert len(bank)==5
+    rng = np.random.default_rng(0)
+    ts = [rng.uniform(0,200,2000), rng.uniform(0,200,4000)]
+    t0 = np.linspace(-20,200,2001)
+    z = bank(ts, t0, chunk_size=10000)
+    assert z.shape == (5,2001)
+    for a,zi in zip(bank.analyses, z):
+        assert np.array_equal(a(ts,t0,method='window',backend='numpy'), zi, equal_nan=True)
@@ -0,0 +1,62 @@
+import os
+import sn_stat as sn
+import numpy as np
+from sn_stat.signals import ccSN
+from sn_stat.rate import Interpolated
+
+def test_shapeana_cache(tmp_path, monkeypatch):
+    B = sn.rate(1)
+    dets = [sn.DetConfig(S=sn.rate(2, range=[-1,1]),B=B),
+            sn.DetConfig(S=sn.rate(3, range=[0,2]),B=B)]
+    ana = sn.ShapeAnalysis(dets, cache=str(tmp_path))
+    assert len(list(tmp_path.glob('*.npz')))==0
+    ana.d0
+    assert len(list(tmp_path.glob('*.npz')))==1
+    #warm start should not calculate anything
+    def fail(*args, **kwargs):
+        raise RuntimeError('JointDistr should not be called')
+    monkeypatch.setattr(sn.cache, 'JointDistr', fail)
+    ana1 = sn.ShapeAnalysis(dets, cache=str(tmp_path))
+    assert np.allclose(ana.d0.bins, ana1.d0.bins)
+    assert np.allclose(ana.d0.vals, ana1.d0.vals)
+    #different parameters or rates are different keys
+    monkeypatch.undo()
+    sn.ShapeAnalysis(dets, cache=str(tmp_path), Nsamples=1000).d0
+    sn.ShapeAnalysis(dets[0], cache=str(tmp_path)).d0
+    assert len(list(tmp_path.glob('*.npz')))==3
+
+def test_cache_eviction(tmp_path):
+    det = sn.DetConfig(S=sn.rate(2, range=[-1,1]),B=sn.rate(1))
+    cache = sn.cache.DistrCache(str(tmp_path))
+    for n in [1000,2000,3000]:
+        cache.joint_distr([sn.LLR(det)], Nsamples=n)
+    files = sorted(tmp_path.glob('*.npz'), key=os.path.getmtime)
+    cache.max_size = os.path.getsize(files[0])+os.path.getsize(files[2])
+    cache.get(files[0].stem)
+    cache.evict()
+    assert sorted(tmp_path.glob('*.npz')) == sorted([files[0],files[2]])
+
+def test_cache_normconv(tmp_path):
+    dets = [sn.DetConfig(B=sn.rate(10), S=ccSN(S0=100).at(10), time_window=[0,15]),
+            sn.DetConfig(B=sn.rate(0.5), S=ccSN(S0=5).at(10), time_window=[0,10])]
+    ana = sn.ShapeAnalysis(dets, cache=str(tmp_path), combine='lazy')
+    ana1 = sn.ShapeAnalysis(dets, cache=str(tmp_path), combine='lazy')
+    assert isinstance(ana.d0, sn.llr.NormConvDistr)
+    assert isinstance(ana1.d0, sn.llr.NormConvDistr)
+    assert np.array_equal(ana.d0.distr.vals, ana1.d0.distr.vals)
+    assert (ana.d0.loc, ana.d0.scale)==(ana1.d0.loc, ana1.d0.scale)
+    assert np.all(ana.l2p(np.linspace(-1,5,13))<=1)
+
+def test_cache_fingerprint():
+    fp = sn.cache.rate_fingerprint
+    r = sn.rate(([0,1,10],[0,2,0]))
+    assert fp(r*2, 0, 10) == fp(sn.rate(([0,1,10],[0,2,0]))*2, 0, 10)
+    assert fp(r*2, 0, 10) != fp(r*3, 0, 10)
+    assert fp(r.shift(1), 0, 10) != fp(r, 0, 10)
+    assert fp(sn.rate(1, range=[0,1]), 0, 10) != fp(sn.rate(1, range=[0,2]), 0, 10)
+    #the spline extrapolation mode
+    assert fp(Interpolated([0,1,5],[1,2,1],ext=0), 0, 10) != fp(Interpolated([0,1,5],[1,2,1],ext=1), 0, 10)
+    #narrow feature of the function
+    f0 = sn.rate(lambda t:np.ones_like(t))
+    f1 = sn.rate(lambda t:1+(np.abs(t-0.3)<1e-4))
+    assert fp(f0, 0, 10) != fp(f1, 0, 10)
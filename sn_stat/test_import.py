@@ -0,0 +1,31 @@
+import sys
+import subprocess
+
+def _run(code):
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+
+def test_lazy_import():
+    #the heavy scipy modules are not imported with sn_stat, and the analysis doesn't compute anything on construction
+    code = '''
+import sys
+import sn_stat as sn
+ana = sn.ShapeAnalysis(sn.DetConfig(B=sn.rate(10), S=sn.rate(1), time_window=[0,10]))
+cana = sn.CountingAnalysis(sn.DetConfig(B=sn.rate(10), S=sn.rate(1), time_window=[0,10]))
+print(ana._d0 is None, cana._d0 is None, *[m in sys.modules for m in ['scipy.stats','scipy.fft','scipy.signal','scipy.integrate','scipy.interpolate']])
+ana.l2z(1.)
+print(ana._d0 is not None, 'scipy.stats' in sys.modules)
+'''
+    assert _run(code) == ['True']*2+['False']*5+['True']*2
+
+def test_single_process_scan():
+    #the single process scan doesn't need multiprocessing.shared_memory (not available in python 3.7)
+    code = '''
+import sys
+import sn_stat as sn
+ana = sn.ShapeAnalysis(sn.DetConfig(B=sn.rate(10), S=sn.rate(1), time_window=[0,10]))
+ana.l_val([1.,2.], [0.])
+print('sn_stat.parallel' in sys.modules)
+import sn_stat.toymc
+print('multiprocessing.shared_memory' in sys.modules)
+'''
+    assert _run(code) == ['False']*2
@@ -1,5 +1,5 @@
 import sn_stat as sn
-from hypothesis import strategies as st, given, assume
+from hypothesis import strategies as st, given, assume, settings
 from hypothesis.extra.numpy import arrays
 import numpy as np
 import pytest
@@ -58,3 +58,164 @@ def test_llr_const_single(t0,t_data,time_window):
     else:
         assert l(t_data,t0)==0
 
+
+@given(arrays(float, elements=Tvalue, shape=st.integers(0,50)),
+       arrays(float, elements=Tvalue, shape=st.integers(0,50)),
+       Trange, st.integers(1,100))
+def test_llr_window(ts, t0, time_window, chunk_size):
+    det = sn.DetConfig(B=sn.rate(1), S=sn.rate(lambda t:1+t**2), time_window=time_window)
+    l = sn.LLR(det)
+    assert np.allclose(l(ts,t0), l(ts,t0,method='window',chunk_size=chunk_size))
+
+@given(st.integers(0,100), st.integers(0,200), st.integers(1,4), st.floats(0.01,10), Trange.filter(lambda r:r[1]-r[0]<1000))
+def test_llr_binned(nt0, nev, n, dt, time_window):
+    det = sn.DetConfig(B=sn.rate(2)*0.5, S=sn.rate(lambda t:1+t**2), time_window=time_window)
+    l = sn.LLR(det)
+    rng = np.random.default_rng(nt0+nev)
+    t0 = -1000+np.arange(nt0)*dt
+    #events in the bin centers: binned calculation is exact
+    h = dt/n
+    ts = t0[0]+(rng.integers(-2000/h, 2000/h, nev)+0.5)*h if nt0 else rng.uniform(-1000,1000,nev)
+    assume(not np.any(np.isin(ts-t0[:,None], time_window)))
+    assert np.allclose(l(ts,t0,method='window'), l(ts,t0,method='binned',time_precision=h*1.0000001))
+
+def test_llr_binned_errors():
+    det = sn.DetConfig(B=sn.rate(([0,10],[1,2])), S=sn.rate(2, range=[-1,1]))
+    with pytest.raises(ValueError):
+        sn.LLR(det)([1,2,3], np.linspace(0,1,11), method='binned')
+    det = sn.DetConfig(B=sn.rate(1), S=sn.rate(2, range=[-1,1]))
+    with pytest.raises(ValueError):
+        sn.LLR(det)([1,2,3], [0,1,3], method='binned')
+
+@settings(deadline=None, max_examples=20)
+@given(arrays(float, elements=Tvalue, shape=st.integers(0,200)),
+       arrays(float, elements=st.floats(-100,100), shape=st.integers(0,50)))
+def test_llr_numba(ts, t0):
+    pytest.importorskip('numba')
+    from sn_stat.rate import LogRate, Interpolated
+    S0 = sn.rate(([0,1,10],[0,2,0]))
+    rates = [S0*3+sn.rate(0.5, range=[1,4]), (S0.shift(2)+S0.invert()).shift(-1)*2, S0.compile((0,10), npoints=1001),
+             LogRate(np.array([0.1,1,5,10]), np.array([1,3,2,0.5]), extrapolate=True)]
+    ts = np.concatenate([ts, np.linspace(-100,100,1001)])
+    for S in rates:
+        l = sn.LLR(sn.DetConfig(B=sn.rate(([-200,200],[1,2])), S=S, time_window=[0.5,10]))
+        res = l(ts, t0, method='window', backend='numba')
+        assert np.allclose(res, l(ts, t0, method='window', backend='numpy'), rtol=1e-12, atol=1e-12)
+    #the extrapolating spline is not supported: "auto" falls back to numpy
+    S = Interpolated([0,1,5],[1,2,1],ext=0)
+    l = sn.LLR(sn.DetConfig(B=sn.rate(1), S=S, time_window=[-0.5,6]))
+    ts1, t01 = np.linspace(-10,20,301), np.linspace(-5,5,11)
+    assert np.allclose(l(ts1, t01, method='window'), l(ts1, t01), rtol=1e-12, atol=1e-12)
+    with pytest.raises(ValueError):
+        l(ts1, t01, method='window', backend='numba')
+    with pytest.raises(ValueError):
+        sn.LLR(sn.DetConfig(B=sn.rate(1), S=sn.rate(lambda t:t), time_window=[0,1]))(ts, t0, method='window', backend='numba')
+
+def test_shapeana_window():
+    S = sn.rate(([0,1,10],[0,2,0]))
+    det = sn.DetConfig(S=S,B=sn.rate(10))
+    ts = sn.Sampler(S*10+det.B, time_window=[-50,50]).sample()
+    t0 = np.linspace(-60,50,1001)
+    ana = sn.ShapeAnalysis(det)
+    assert np.allclose(ana.l_val(ts,t0), ana.l_val(ts,t0,method='window',chunk_size=1000))
+
+def test_joint_distr_adaptive():
+    from sn_stat.signals import ccSN
+    dets = [sn.DetConfig(B=sn.rate(1), S=ccSN(S0=100).at(10), time_window=[0,15]),
+            sn.DetConfig(B=sn.rate(2), S=sn.rate(([0,1,10],[0,2,0])), time_window=[0,10])]
+    llrs = [sn.LLR(d) for d in dets]
+    for hypos in ['H0', [d.B+d.S for d in dets]]:
+        d0 = sn.JointDistr(llrs, hypos, adaptive=False)
+        d1 = sn.JointDistr(llrs, hypos, adaptive=True)
+        assert len(d1.vals) < len(d0.vals)
+        assert np.allclose(d0.bins[:len(d1.bins)], d1.bins)
+        assert np.allclose(d0.vals[:len(d1.vals)], d1.vals, rtol=0, atol=1e-15)
+        assert d0.vals[len(d1.vals):].sum() < 1e-14
+
+def test_joint_distr_batch():
+    from sn_stat.signals import ccSN
+    sig = ccSN(S0=100)
+    dets = [sn.DetConfig(B=sn.rate(1), S=sig.at(10), time_window=[0,15]),
+            sn.DetConfig(B=sn.rate(200), S=sig.at(10)*10, time_window=[0,15])]
+    llrs = [sn.LLR(d) for d in dets]
+    hypos_list = ['H0']+[[d.B+sig.at(dist)*k for d,k in zip(dets,[1,10])] for dist in [5,10,20]]
+    ds = sn.JointDistrBatch(llrs, hypos_list, workers=4, scaled=False)
+    assert len(ds)==len(hypos_list)
+    l = np.linspace(-10,500,1001)
+    for hypos,d in zip(hypos_list, ds):
+        assert np.array_equal(d.sf(l), sn.JointDistr(llrs, hypos).sf(l))
+
+def test_joint_distr_scaled():
+    from sn_stat.signals import ccSN
+    sigs = [ccSN(S0=100), ccSN(S0=10)]
+    for B in [[1,0.1],[200,300]]:
+        dets = [sn.DetConfig(B=sn.rate(b), S=s.at(10), time_window=[0,15]) for b,s in zip(B,sigs)]
+        llrs = [sn.LLR(d) for d in dets]
+        hypos_list = ['H0']+[[d.B+s.at(dist) for d,s in zip(dets,sigs)] for dist in [2,5,10,20,50]]
+        hypos_list += [[s.at(20)*3 for s in sigs]]
+        ds = sn.JointDistrBatch(llrs, hypos_list)
+        l = np.linspace(-10,1000,1001)
+        for hypos,d in zip(hypos_list, ds):
+            d0 = sn.JointDistr(llrs, hypos)
+            assert type(d)==type(d0)
+            assert np.allclose(d.sf(l), d0.sf(l), rtol=0, atol=1e-12)
+
+@settings(deadline=None)
+@given(distrS(), st.floats(-10,10), st.floats(1e-3,10))
+def test_normconv_distr(d, loc, scale):
+    from scipy import stats
+    nc = sn.llr.NormConvDistr(d, loc, scale)
+    c = 0.5*(d.bins[1:]+d.bins[:-1])
+    l = np.linspace(c[0]+loc-15*scale, c[-1]+loc+15*scale, 201)
+    sf = stats.norm.sf(l[:,None], loc=loc+c, scale=scale)@d.vals
+    assert np.allclose(nc.sf(l), sf, rtol=1e-10, atol=1e-30)
+    assert np.allclose(nc.pdf(l), stats.norm.pdf(l[:,None], loc=loc+c, scale=scale)@d.vals, rtol=1e-10, atol=1e-30)
+    p = np.array([0.9,0.5,0.1,1e-3])
+    assert np.allclose(nc.sf(nc.isf(p)), p, rtol=1e-9)
+    assert np.isclose(nc.mean(), d.vals@c+loc)
+    assert np.isclose(nc.var(), d.vals@(c-d.vals@c)**2+scale**2)
+
+def test_joint_distr_combine():
+    from sn_stat.signals import ccSN
+    dets = [sn.DetConfig(B=sn.rate(10), S=ccSN(S0=100).at(10), time_window=[0,15]),
+            sn.DetConfig(B=sn.rate(0.5), S=ccSN(S0=5).at(10), time_window=[0,10])]
+    llrs = [sn.LLR(d) for d in dets]
+    d0 = sn.JointDistr(llrs, combine='fft')
+    d1 = sn.JointDistr(llrs, combine='lazy')
+    assert isinstance(d0, sn.llr.Distr) and isinstance(d1, sn.llr.NormConvDistr)
+    l = np.linspace(-1,3,101)
+    #binning error of the histograms convolution
+    assert np.allclose(d0.sf(l), d1.sf(l), atol=3e-3)
+    with pytest.raises(ValueError):
+        sn.JointDistr(llrs, combine='direct')
+
+def test_adaptive_sampling():
+    from sn_stat.signals import ccSN
+    det = sn.DetConfig(B=sn.rate(1), S=ccSN(S0=100).at(10), time_window=[0,15])
+    l = sn.LLR(det)
+    ts,ls = l.sample_points(10000, 0, 'adaptive')
+    assert len(ts)<1000 and np.all(np.diff(ts)>0)
+    assert (ts[0],ts[-1])==(0,15)
+    #memoised samples
+    assert l.sample_points(10000, 0, 'adaptive')[0] is ts
+    assert l.l_range(0, sampling='adaptive')==(ls.min(), ls.max())
+    x = np.linspace(0, ls.max(), 1001)
+    for h in ['H0', det.B+det.S]:
+        ref = l.distr(h, Nsamples=10**6, dl=1e-3*ls.max())
+        d = l.distr(h, sampling='adaptive', dl=1e-3*ls.max())
+        assert np.isclose(d.vals.sum(), 1)
+        assert np.max(np.abs(d.sf(x)-ref.sf(x)))<1e-3
+        n0, n1 = l.distr(h, sampling='adaptive', normal=True), l.distr(h, Nsamples=10**6, normal=True)
+        assert np.isclose(n0.mean(), n1.mean(), rtol=1e-3) and np.isclose(n0.std(), n1.std(), rtol=1e-3)
+    d0 = sn.JointDistr([l], sampling='adaptive')
+    d1 = sn.JointDistr([l])
+    assert np.max(np.abs(d0.sf(x)-d1.sf(x)))<1e-3
+    with pytest.raises(ValueError):
+        l.sample_points(100, 0, 'random')
+
+@given(distrS())
+def test_distr_buffer(d):
+    d1 = sn.llr.Distr.from_buffer(d.to_buffer())
+    assert np.array_equal(d1.bins, d.bins)
+    assert np.array_equal(d1.vals, d.vals)
+    assert np.array_equal(d1.sf(d.bins), d.sf(d.bins))
@@ -0,0 +1,57 @@
+import sys
+import json
+import pytest
+import subprocess
+import numpy as np
+import sn_stat as sn
+from sn_stat import profiling
+from sn_stat.signals import ccSN
+
+def test_profile_stages():
+    det = sn.DetConfig(B=sn.rate(10), S=ccSN(S0=100).at(10), time_window=[0,15])
+    assert profiling.report() is None
+    with profiling.profile() as report:
+        assert profiling.enabled()
+        ana = sn.ShapeAnalysis(det, Nsamples=1000)
+        ts = sn.Sampler(det.B, time_window=[0,100], rng=0).sample()
+        z = ana(ts, np.linspace(0,80,50), method='window')
+    assert not profiling.enabled()
+    res = report.to_dict()
+    for name in ['LLR.sample','LLR.llr','LLR.llr_window','JointDistrBatch','JointDistr.integrals',
+                 'JointDistr.histograms','JointDistr.fft','JointDistr.combine','Sampler.sample',
+                 'Analysis.ztable','Analysis.l2z','rate.integral']:
+        assert res[name]['calls']>=1, name
+        assert res[name]['time']>=0
+    assert res['LLR.llr_window']['size'] == len(ts)
+    assert res['Analysis.l2z']['size'] == len(z)
+    assert res['LLR.sample']['max_size'] == 1000
+    assert res['LLR.llr']['peak_memory'] is None
+    assert name in str(report)
+    assert json.loads(report.to_json()) == res
+
+@pytest.mark.skipif(sys.version_info<(3,9), reason='tracemalloc.reset_peak needs python>=3.9')
+def test_profile_memory():
+    with profiling.profile(memory=True) as report:
+        with profiling.stage('outer'):
+            with profiling.stage('inner', 10):
+                a = np.ones(2**20)
+            del a
+            b = np.ones(2**18)
+    res = report.to_dict()
+    assert res['inner']['size'] == 10
+    assert 8*2**20 <= res['inner']['peak_memory'] < 9*2**20
+    #the peak of the nested stage is included
+    assert res['outer']['peak_memory'] >= res['inner']['peak_memory']
+    #nothing is recorded outside of the context
+    with profiling.stage('outer'):
+        pass
+    assert report.to_dict()['outer']['calls'] == 1
+
+def test_profile_env(tmp_path):
+    fname = str(tmp_path/'profile.json')
+    code = 'import sn_stat as sn; sn.Sampler(sn.rate(10), rng=0).sample_many(5)'
+    env = dict(PYTHONPATH=':'.join(sys.path), SN_STAT_PROFILE=fname)
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    with open(fname) as f:
+        res = json.load(f)
+    assert res['Sampler.sample_many']['size'] == 5
@@ -1,5 +1,6 @@
 from sn_stat import rate, log_rate
-from hypothesis import strategies as st, given
+from sn_stat.rate import LogRate
+from hypothesis import strategies as st, given, settings
 from hypothesis.extra.numpy import arrays
 import numpy as np
 
@@ -86,3 +87,32 @@ def test_interp(xy):
     assert r.range[1]==x[-1]
     assert np.allclose(r(x), y)
 
+
+@given(lims=Ranges, dx=st.floats(-100,100), c=st.floats(0,100))
+def test_compile(lims, dx, c):
+    r = (rate(lambda t:np.exp(-t**2)) + rate(c, range=lims)).shift(dx)*2
+    rc = r.compile((-200,200), npoints=1001)
+    ts = np.linspace(-200,200,101)
+    assert np.all(np.abs(rc(ts)-r(ts)) <= rc.error+1e-12)
+    I = rc.integral(ts[:-1], ts[1:])
+    assert I.shape == (100,)
+    for t0,t1,i in zip(ts[:-1],ts[1:],I):
+        assert abs(i-r.integral(t0,t1)) <= rc.error*(t1-t0)+1e-9
+
+def all_rates(xy):
+    x,y = xy
+    r0 = rate(lambda t:np.exp(-(t/1e4)**2))
+    return [rate(2.5), r0, rate(xy), log_rate((np.arange(1,6),np.arange(5,0,-1))),
+            rate(2, range=(x[0],x[-1])), r0*3, r0+rate(xy), r0.shift(x[0]), rate(xy).invert()]
+
+@settings(max_examples=20, deadline=None)
+@given(xy=xyS(), t0=arrays(float, elements=Xvalues, shape=5), t1=arrays(float, elements=Xvalues, shape=5))
+def test_integral_vectorized(xy, t0, t1):
+    for r in all_rates(xy):
+        a,b = (np.clip(t0,1,5),np.clip(t1,1,5)) if isinstance(r, LogRate) else (t0,t1)
+        I = r.integral(a,b)
+        assert I.shape == a.shape
+        assert np.allclose(I, [r.integral(x0,x1) for x0,x1 in zip(a,b)], equal_nan=True)
+        assert np.isscalar(r.integral(a[0],b[0]))
+        #broadcasting
+        assert r.integral(a[:3,None],b).shape == (3,5)
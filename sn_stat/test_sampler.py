@@ -0,0 +1,27 @@
+import sn_stat as sn
+from sn_stat.sampler import split
+import numpy as np
+
+def test_sampler_seed():
+    r = sn.rate(([0,1,10],[0,2,0]))*100
+    s0 = sn.Sampler(r, time_window=[0,10], rng=1)
+    s1 = sn.Sampler(r, time_window=[0,10], rng=1)
+    assert np.array_equal(s0.sample(), s1.sample())
+    ts0,offs0 = s0.sample_many(10)
+    ts1,offs1 = s1.sample_many(10)
+    assert np.array_equal(ts0,ts1)
+    assert np.array_equal(offs0,offs1)
+
+def test_sampler_many():
+    r = sn.rate(([0,1,10],[0,2,0]))*100
+    s = sn.Sampler(r, time_window=[0,10], rng=0)
+    ts,offsets = s.sample_many(1000, dtype=np.float32)
+    assert ts.dtype == np.float32
+    assert len(offsets) == 1001
+    assert offsets[0]==0 and offsets[-1]==len(ts)
+    assert np.all((ts>=0)&(ts<=10))
+    Ns = np.diff(offsets)
+    assert abs(Ns.mean()-1000) < 5
+    assert [len(t) for t in split(ts,offsets)] == list(Ns)
+    #mean time of the triangular distribution
+    assert abs(ts.mean()-11/3) < 0.01
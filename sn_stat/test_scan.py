@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+import sn_stat as sn
+from sn_stat.scan import scan_file, open_events
+
+def test_scan_file(tmp_path):
+    S = sn.rate(([0,1,10],[0,2,0]))
+    dets = [sn.DetConfig(S=S*k,B=sn.rate(10*k)) for k in (1,2)]
+    ts = [np.sort(sn.Sampler(d.B, time_window=[0,500]).sample()) for d in dets]
+    np.save(tmp_path/'a.npy', ts[0])
+    ts[1].tofile(tmp_path/'b.bin')
+    files = [str(tmp_path/'a.npy'), str(tmp_path/'b.bin')]
+    assert np.array_equal(open_events(files[1]), ts[1])
+    t0 = np.linspace(-20,510,5001)
+    ana = sn.ShapeAnalysis(dets)
+    z = ana(ts, t0, method='window')
+    for chunk in [1, 13.7, 1000]:
+        assert np.array_equal(z, scan_file(ana, files, t0, chunk_duration=chunk), equal_nan=True)
+    scan_file(ana, files, t0, output=str(tmp_path/'z.npy'), chunk_duration=20)
+    assert np.array_equal(z, np.load(tmp_path/'z.npy'), equal_nan=True)
+    #counting analysis
+    ana = sn.CountingAnalysis(dets[0])
+    assert np.array_equal(ana(ts[0],t0), scan_file(ana, files[0], t0, chunk_duration=7))
+    with pytest.raises(ValueError):
+        scan_file(ana, ts[0][::-1], t0)
@@ -1,4 +1,6 @@
 import sn_stat as sn
+import numpy as np
+from sn_stat.signals import ccSN
 
 def test_shapeana():
     B = sn.rate(1)
@@ -6,3 +8,83 @@ def test_shapeana():
     det = sn.DetConfig(S=S,B=B)
     ana = sn.ShapeAnalysis([det])
     assert ana is not None
+
+def test_z_quant_batch(tmp_path, monkeypatch):
+    dets = [sn.DetConfig(S=ccSN(S0=100).at(10),B=sn.rate(1), time_window=[0,15]),
+            sn.DetConfig(S=sn.rate(3, range=[0,2]),B=sn.rate(2))]
+    hypos_list = [[d.S*k for d in dets] for k in [0.1,0.5,1,2]]
+    ana = sn.ShapeAnalysis(dets)
+    zs = ana.z_quant_batch(hypos_list, add_bg=True, workers=2)
+    assert zs.shape==(4,3)
+    assert np.allclose(zs, [ana.z_quant(h, add_bg=True) for h in hypos_list], rtol=0, atol=1e-6)
+    #only the missing distributions are calculated with cache
+    cached = sn.ShapeAnalysis(dets, cache=str(tmp_path))
+    cached.l_distr(hypos_list[1], add_bg=True)
+    calls = []
+    def batch(llrs, hypos_list, **params):
+        calls.append(len(hypos_list))
+        return sn.JointDistrBatch(llrs, hypos_list, **params)
+    monkeypatch.setattr(sn.cache, 'JointDistrBatch', batch)
+    assert np.array_equal(cached.z_quant_batch(hypos_list, add_bg=True), zs)
+    assert calls==[3]
+
+def test_time_varying(tmp_path):
+    S = sn.rate(([0,1,10],[0,2,0]))
+    B = sn.rate(([-100,0,5,200],[1,1,3,3]))
+    det = sn.DetConfig(S=S, B=B, time_window=[0,10])
+    ana = sn.TimeVaryingShapeAnalysis(det, (-40,40), cache=str(tmp_path), npoints=5, rtol=0.05)
+    ts, anas = ana.grid()
+    #refined only where the background changes
+    assert np.allclose(ts[:2], [-40,-20]) and np.allclose(ts[-2:], [20,40])
+    assert len(ts)>5 and np.all(np.diff(ts)>0)
+    assert len(list(tmp_path.glob('*.npz')))==len(ts)
+    l = np.linspace(0,5,11)
+    for t in ts[[0,3,-1]]:
+        assert np.array_equal(ana.l2z(l,t), sn.ShapeAnalysis(det, t0=t).l2z(l), equal_nan=True)
+    #interpolation between the grid points and constant outside of the grid
+    tm = 0.5*(ts[3]+ts[4])
+    z0, z1, z = ana.l2z(l,ts[3]), ana.l2z(l,ts[4]), ana.l2z(l,tm)
+    assert np.all((z>=np.minimum(z0,z1)-1e-12)&(z<=np.maximum(z0,z1)+1e-12))
+    assert np.array_equal(ana.l2z(l,-100), ana.l2z(l,-40))
+    data = sn.Sampler(B, time_window=[-50,50]).sample()
+    t0 = np.linspace(-40,40,101)
+    assert np.array_equal(ana(data,t0), ana.l2z(ana.l_val(data,t0),t0))
+    #constant background: no refinement
+    ana = sn.TimeVaryingShapeAnalysis(sn.DetConfig(S=S, B=sn.rate(1), time_window=[0,10]), (-40,40), npoints=5)
+    assert np.array_equal(ana.grid()[0], np.linspace(-40,40,5))
+
+def test_shapeana_parallel():
+    S = sn.rate(([0,1,10],[0,2,0]))
+    dets = [sn.DetConfig(S=S*k,B=sn.rate(10*k)) for k in (1,2,3)]
+    ana = sn.ShapeAnalysis(dets)
+    ts = [sn.Sampler(d.B, time_window=[0,100]).sample() for d in dets]
+    t0 = np.linspace(-10,100,1001)
+    for method in ['dense','window']:
+        l = ana.l_val(ts, t0, method=method)
+        for shard in ['t0','det','both']:
+            assert np.array_equal(l, ana.l_val(ts, t0, workers=2, shard=shard, method=method))
+
+def test_counting_batch():
+    det = sn.DetConfig(S=sn.rate(2, range=[-1,1]), B=sn.rate(10))
+    ana = sn.CountingAnalysis(det)
+    datasets = [sn.Sampler(det.B, time_window=[0,20]).sample() for i in range(10)]+[np.array([])]
+    t0 = np.linspace(-2,22,241)
+    ls = ana.l_val_batch(datasets, t0)
+    assert ls.shape == (11,241)
+    for d,l in zip(datasets, ls):
+        T = np.expand_dims(t0,1)+det.time_window
+        assert np.array_equal(l, [np.sum((d>=t[0])&(d<=t[1])) for t in T])
+        assert np.array_equal(l, ana.l_val(d,t0))
+    assert np.allclose(ana.z_batch(datasets,t0), ana.l2z(ls))
+
+def test_ztable():
+    S = sn.rate(([0,1,10],[0,2,0]))
+    for B in [1,100]:
+        det = sn.DetConfig(S=S,B=sn.rate(B))
+        for ana in [sn.ShapeAnalysis([det]), sn.CountingAnalysis(det)]:
+            l = ana.d0.isf(np.linspace(0,1,1001))
+            l = np.concatenate([l, l+0.5, [-np.inf,np.inf,1e4]])
+            table = ana.ztable()
+            assert table.z_precision<=1e-6
+            #exact values in the step and integer tables
+            assert np.allclose(ana.l2z(l), ana.l2z_exact(l), atol=table.z_precision, rtol=0, equal_nan=True)
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from sn_stat.signals import build_archive, ModelArchive, from_file
+
+def test_model_archive(tmp_path):
+    rng = np.random.default_rng(0)
+    (tmp_path/'models').mkdir()
+    for name in ['a','b','c']:
+        np.savetxt(tmp_path/'models'/f'{name}.txt', rng.uniform(0,10,rng.integers(1,100)))
+    build_archive(str(tmp_path/'models'), str(tmp_path/'models.bin'))
+    arch = ModelArchive(str(tmp_path/'models.bin'))
+    assert arch.names() == ['a','b','c']
+    t = np.linspace(-1,1,101)
+    for name in arch:
+        fname = str(tmp_path/'models'/f'{name}.txt')
+        assert np.array_equal(arch.values(name), np.loadtxt(fname))
+        s = arch.signal(name, dt=0.01, distance=5, scale=2)
+        assert np.array_equal(s.at(3)(t), from_file(fname, dt=0.01, distance=5, scale=2).at(3)(t))
+        assert arch.signal(name, dt=0.01, distance=5, scale=2) is s
+    with pytest.raises(ValueError):
+        ModelArchive(str(tmp_path/'models'/'a.txt'))
@@ -0,0 +1,30 @@
+import sn_stat as sn
+import numpy as np
+
+def test_shape_stream():
+    S = sn.rate(([0,1,10],[0,2,0]))
+    dets = [sn.DetConfig(S=S,B=sn.rate(10)),
+            sn.DetConfig(S=sn.rate(1,range=[-2,3]),B=sn.rate(5))]
+    ana = sn.ShapeAnalysis(dets)
+    ts = [sn.Sampler(d.B, time_window=[0,100]).sample() for d in dets]
+    stream = sn.ShapeStream(ana, dt=0.1, t_start=-20)
+    t0s,zs = [],[]
+    for t in np.arange(5,105,5):
+        t0,z = stream.push([d[(d>=t-5)&(d<t)] for d in ts], now=t)
+        t0s+=[t0]
+        zs+=[z]
+    t0 = np.concatenate(t0s)
+    assert np.allclose(np.diff(t0), 0.1)
+    assert np.isclose(np.round((t0[0]+20)/0.1), (t0[0]+20)/0.1)
+    assert t0[0]+dets[0].time_window[1] >= min(d.min() for d in ts)-0.1
+    assert t0[-1]+dets[0].time_window[1] < 100
+    assert np.allclose(ana(ts,t0), np.concatenate(zs))
+
+def test_shape_stream_start():
+    det = sn.DetConfig(S=sn.rate(1, range=[0,2]), B=sn.rate(5))
+    stream = sn.ShapeStream(sn.ShapeAnalysis(det), dt=0.5)
+    t0,z = stream.push([])
+    assert len(t0)==0 and len(z)==0
+    #the grid starts at the first data, not at t_start
+    t0,z = stream.push([1e6, 1e6+1])
+    assert list(t0) == [1e6-2, 1e6-1.5]
@@ -0,0 +1,40 @@
+import sn_stat as sn
+from sn_stat.toymc import ToyMC
+from sn_stat.signals import ccSN
+import numpy as np
+import pytest
+
+S = ccSN(S0=100)
+det = sn.DetConfig(B=sn.rate(10), S=S.at(1), time_window=[0,5])
+t0 = np.linspace(-5,20,251)
+
+def test_toymc_workers():
+    ana = sn.CountingAnalysis(det)
+    mc1 = ToyMC(ana, t0, [-10,30], seed=1, workers=1, ntrials_task=50).run(200, S, [None,2])
+    mc2 = ToyMC(ana, t0, [-10,30], seed=1, workers=2, ntrials_task=50).run(200, S, [None,2])
+    for d in [None,2]:
+        assert mc1.ntrials(d) == 200
+        assert np.array_equal(mc1.hists[d], mc2.hists[d])
+    z,p = mc1.pvalues()
+    assert p[0]==1 and np.all(np.diff(p)<=0)
+    assert mc1.efficiency(3,[2])[0] > mc1.efficiency(3,[None])[0]
+
+def test_toymc_checkpoint(tmp_path):
+    ana = sn.ShapeAnalysis(det)
+    fname = str(tmp_path/'mc.npz')
+    mc = ToyMC(ana, t0, [-10,30], seed=2, workers=1, ntrials_task=10, checkpoint=fname).run(20, S, [3])
+    #resume: only the missing tasks are run
+    mc1 = ToyMC(ana, t0, [-10,30], workers=1, ntrials_task=10, checkpoint=fname)
+    assert mc1.ntrials(3)==20
+    mc1.run(40, S, [3])
+    mc2 = ToyMC(ana, t0, [-10,30], seed=2, workers=1, ntrials_task=10).run(40, S, [3])
+    assert np.array_equal(mc1.hists[3.], mc2.hists[3.])
+    #the batch size of the checkpoint is used
+    mc3 = ToyMC(ana, t0, [-10,30], workers=1, ntrials_task=20, checkpoint=fname)
+    assert mc3.ntrials_task==10
+    assert mc3.run(40, S, [3]).ntrials(3)==40
+
+def test_toymc_no_signal():
+    ana = sn.CountingAnalysis(det)
+    with pytest.raises(ValueError):
+        ToyMC(ana, t0, [-10,30], workers=1).run(10, None, [5.])
@@ -0,0 +1,202 @@
+import os
+import numpy as np
+from concurrent.futures import as_completed
+from .sampler import Sampler, split
+from .sig_calc import CountingAnalysis
+from .signals import Signal
+from .parallel import make_pool, _worker
+
+def _init_toymc(mc):
+    _worker['toymc'] = mc
+
+def _toymc_task(distance, seed):
+    return _worker['toymc'].run_task(distance, seed)
+
+class ToyMC:
+    """
+    Toy Monte-Carlo engine for the empirical false alarm probability and detection efficiency.
+
+    Each trial is the random dataset in `time_window` for each detector, with the background rate,
+    or with the background plus signal at given distance.
+    The analysis is applied to the dataset, and the maximal significance over the `t0` grid
+    is added to the running histogram, so the trials are not kept in memory.
+    The trials are done in batches of `ntrials_task` in the process pool,
+    each batch with its own random stream, derived from the `seed`.
+
+    Args:
+        analysis (:class:`ShapeAnalysis` or :class:`CountingAnalysis`):
+            the analysis to test
+        t0 (ndarray of float):
+            the assumed signal start times, scanned in each trial
+        time_window (tuple(float,float)):
+            time range of the generated data
+        zbins (ndarray of float):
+            bins of the maximal significance histograms
+        seed (int or None):
+            the seed of all the random streams. If None, a random seed is chosen
+        checkpoint (str or None):
+            name of the file to store the results after each batch.
+            If the file exists, the results are loaded from it, and the run is resumed
+            (with the `seed`, `zbins` and `ntrials_task` of the checkpoint)
+        ntrials_task (int):
+            number of trials in each batch
+        workers (int or None):
+            number of processes. If 1 - run in this process, if None - use all CPUs
+        Npoints (int):
+            number of points for :class:`Sampler`
+
+    Keyword Args:
+        params (dict of kwargs): parameters to pass to the analysis
+    """
+    def __init__(self, analysis, t0, time_window, zbins=np.linspace(-5,20,2501), *, seed=None,
+                 checkpoint=None, ntrials_task=100, workers=None, Npoints=10000, **params):
+        self.ana = analysis
+        self.dets = [analysis.det] if isinstance(analysis, CountingAnalysis) else analysis.det
+        self.t0 = np.asarray(t0)
+        self.time_window = time_window
+        self.zbins = np.asarray(zbins)
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.checkpoint = checkpoint
+        self.ntrials_task = ntrials_task
+        self.workers = workers
+        self.Npoints = Npoints
+        self.params = params
+        #results: histogram (with underflow and overflow bins) and list of done tasks for each distance
+        self.hists = {}
+        self.done = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load(checkpoint)
+
+    @staticmethod
+    def _key(distance):
+        return None if distance is None else float(distance)
+
+    def rates(self, signals=None, distance=None):
+        """ the event rates for each detector: background plus signals at given distance"""
+        if signals is None or distance is None:
+            return [d.B for d in self.dets]
+        if isinstance(signals, Signal):
+            signals = [signals]
+        return [d.B+s.at(distance) for d,s in zip(self.dets, signals)]
+
+    def max_z(self, datasets):
+        """ maximal significance over `t0` for each trial
+
+        Args:
+            datasets (list of list of ndarray): the events for each detector and each trial
+        """
+        if isinstance(self.ana, CountingAnalysis):
+            return self.ana.z_batch(datasets[0], self.t0).max(axis=1)
+        return np.array([self.ana(data, self.t0, **self.params).max() for data in zip(*datasets)])
+
+    def run_task(self, distance, seed):
+        """ run one batch of trials with given random seed
+
+        Returns:
+            ndarray: histogram of the maximal significance
+        """
+        rng = np.random.default_rng(seed)
+        datasets = []
+        for r in self.rates(self.signals, distance):
+            s = Sampler(r, time_window=self.time_window, Npoints=self.Npoints, rng=rng)
+            datasets += [split(*s.sample_many(self.ntrials_task))]
+        zs = np.nan_to_num(self.max_z(datasets), nan=-np.inf)
+        edges = np.concatenate([[-np.inf],self.zbins,[np.inf]])
+        return np.histogram(zs, bins=edges)[0]
+
+    def run(self, ntrials, signals=None, distances=[None]):
+        """
+        Run the trials (in addition to the already done ones)
+
+        Args:
+            ntrials (int): number of trials for each distance (rounded up to `ntrials_task`)
+            signals (:class:`Signal` or list of :class:`Signal` or None):
+                the signal for each detector. If None - run the background only trials
+            distances (list of float): distances to the source. None means background only
+        Raises:
+            ValueError: if a distance is given without `signals`
+        """
+        if signals is None and any(d is not None for d in distances):
+            raise ValueError('The signals are needed for the trials at the given distances')
+        self.signals = signals
+        ntasks = -(-ntrials//self.ntrials_task)
+        tasks = []
+        for dist in distances:
+            key = self._key(dist)
+            self.hists.setdefault(key, np.zeros(len(self.zbins)+1, dtype=int))
+            done = self.done.setdefault(key, set())
+            tasks += [(dist,key,i) for i in range(ntasks) if i not in done]
+        def seed(key,i):
+            #independent stream for each distance and task index
+            k = 0 if key is None else int(np.float64(key).view(np.uint64))
+            return np.random.SeedSequence(self.seed, spawn_key=(k,i))
+        def add(key,i,h):
+            self.hists[key]+=h
+            self.done[key].add(i)
+            if self.checkpoint is not None:
+                self.save(self.checkpoint)
+
+        #the significance table is built once, before the workers are forked
+        self.ana.ztable()
+        if self.workers==1:
+            for dist,key,i in tasks:
+                add(key,i,self.run_task(dist, seed(key,i)))
+            return self
+        with make_pool(self.workers, _init_toymc, (self,)) as pool:
+            futures = {pool.submit(_toymc_task, dist, seed(key,i)):(key,i) for dist,key,i in tasks}
+            for f in as_completed(futures):
+                add(*futures[f], f.result())
+        return self
+
+    def ntrials(self, distance=None):
+        """ number of done trials for given distance"""
+        return self.hists[self._key(distance)].sum()
+
+    def pvalues(self, distance=None):
+        """
+        Empirical p-value table: probability of the maximal significance to be above each of `zbins`
+
+        Returns:
+            tuple(ndarray,ndarray): `zbins` and p-values
+        """
+        h = self.hists[self._key(distance)]
+        tail = np.cumsum(h[::-1])[::-1]
+        return self.zbins, tail[1:]/h.sum()
+
+    def efficiency(self, z_threshold, distances):
+        """
+        Detection efficiency: probability of the maximal significance to be above `z_threshold`
+        (rounded up to the nearest bin edge) for each distance
+
+        Returns:
+            ndarray: efficiency for each distance
+        """
+        i = np.searchsorted(self.zbins, z_threshold)
+        return np.array([self.pvalues(d)[1][min(i,len(self.zbins)-1)] for d in distances])
+
+    def save(self, fname):
+        """ save the results to the file """
+        keys = list(self.hists)
+        #background only trials are stored with nan distance
+        dists = [np.nan if k is None else k for k in keys]
+        done = [(d,i) for k,d in zip(keys,dists) for i in self.done[k]]
+        tmpname = f'{fname}.tmp'
+        with open(tmpname,'wb') as f:
+            np.savez(f, seed=str(self.seed), zbins=self.zbins, ntrials_task=self.ntrials_task,
+                     keys=np.array(dists, dtype=float),
+                     hists=np.array([self.hists[k] for k in keys]).reshape(len(keys),-1),
+                     done=np.array(done, dtype=float).reshape(-1,2))
+        os.replace(tmpname, fname)
+
+    def load(self, fname):
+        """ load the results from the file """
+        with np.load(fname) as f:
+            self.seed = int(str(f['seed']))
+            self.zbins = f['zbins']
+            #the done tasks indices are meaningful only with the same batch size
+            self.ntrials_task = int(f['ntrials_task'])
+            key = lambda d: None if np.isnan(d) else float(d)
+            self.hists = {key(d):h for d,h in zip(f['keys'],f['hists'])}
+            self.done = {k:set() for k in self.hists}
+            for d,i in f['done']:
+                self.done[key(d)].add(int(i))